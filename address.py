@@ -0,0 +1,114 @@
+"""
+parsing of the street addresses of hemnet and faktakontroll.
+
+    >>> parse('Götgatan 48 B lgh 1203')
+    Address(street='Götgatan', number='48 B', floor=2, apartment='1203')
+    >>> split_floor('Götgatan 48, 3 tr')
+    ('Götgatan 48', 3)
+
+floors are written as "3 tr" or "vån 3". the first two digits of swedish apartment numbers ("lgh 1203")
+are the floor plus 10: 10 on the ground floor, 12 on the second floor, 09 in the basement.
+the patterns are compiled once here, an address is scanned once for each of them
+"""
+import re
+from typing import NamedTuple, Optional
+
+# (text every match contains, pattern). the regex is only run if the text is in the address
+FLOOR_PATTERNS = (
+    ('tr', re.compile(r'(\d{1,2}) ?tr')),
+    ('vån', re.compile(r'vån ?(\d{1,2})')),
+)
+# the first four digits after "lgh"
+APARTMENT_RE = re.compile(r'lgh.*?(\d{4})', re.DOTALL)
+APARTMENT_PART_RE = re.compile(r'\s*\blgh\b\.?\s*\d*', re.IGNORECASE)
+# street name, then the number with an optional entrance letter: "Götgatan 48", "Götgatan 48B", "Götgatan 48 B"
+STREET_NUMBER_RE = re.compile(r'\s*(\D*?)\s*(\d+(?: ?[a-zåäö]\b)?)', re.IGNORECASE)
+
+
+class Address(NamedTuple):
+    street: str
+    number: Optional[str]
+    floor: Optional[int]
+    apartment: Optional[str]
+
+
+def find_floor(text):
+    """:return: (floor marker pattern, match) of the first floor marker found in `text`, or (None, None)"""
+    for literal, pattern in FLOOR_PATTERNS:
+        if literal in text:
+            match = pattern.search(text)
+            if match:
+                return pattern, match
+    return None, None
+
+
+def split_floor(full_address):
+    """
+    :return: street address without anything after the comma and without the floor, floor number
+    """
+    floor = None
+    # remove everything after comma
+    address_wo_floor = full_address.split(',')[0]
+
+    # remove from address: <number> tr, vån <number>
+    pattern, match = find_floor(address_wo_floor)
+    if match:
+        floor = int(match.group(1))
+        address_wo_floor = pattern.sub('', address_wo_floor).strip()
+
+    # if floor already not found get it from the entire address
+    if not floor:
+        pattern, match = find_floor(full_address)
+        if match:
+            floor = int(match.group(1))
+    return address_wo_floor, floor
+
+
+def apartment_floor(apartment):
+    return (int(apartment[0]) - 1) * 10 + int(apartment[1])
+
+
+def parse(full_address):
+    """
+    split an address into street, number, floor and apartment. a floor written out in the address
+    is used before the one of the apartment number
+    """
+    street_address, floor = split_floor(full_address)
+
+    apartment = None
+    if 'lgh' in full_address:
+        match = APARTMENT_RE.search(full_address)
+        apartment = match.group(1) if match else None
+    if floor is None and apartment:
+        floor = apartment_floor(apartment)
+
+    if 'lgh' in street_address.lower():
+        street_address = APARTMENT_PART_RE.sub('', street_address)
+    match = STREET_NUMBER_RE.match(street_address)
+    if match and match.group(1):
+        street, number = match.group(1), ' '.join(match.group(2).split()) or None
+    else:
+        street, number = ' '.join(street_address.split()), None
+    return Address(street, number, floor, apartment)
+
+
+def parse_many(addresses):
+    """:return: the Address of every address, in the same order"""
+    return list(map(parse, addresses))
+
+
+def normalize(search_string):
+    """
+    key of a faktakontroll search. case, extra whitespace and floor markers don't change the key
+    """
+    parts = []
+    for part in search_string.lower().split(','):
+        part, _ = split_floor(part)
+        part = ' '.join(part.split())
+        if part:
+            parts.append(part)
+    return ', '.join(parts)
+
+
+def normalize_many(search_strings):
+    return list(map(normalize, search_strings))
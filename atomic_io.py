@@ -0,0 +1,67 @@
+"""
+file writes that other scripts can't see half done.
+
+`file_lock` takes an advisory lock on <path>.lock so read-modify-write cycles of different processes
+don't interleave, `atomic_write` writes to a temporary file next to the target and renames it over the target
+"""
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+
+@contextmanager
+def file_lock(path):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(f'{path}.lock', 'a+') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextmanager
+def atomic_write(path, mode='w', **kwargs):
+    """
+    open a temporary file to write `path`. it replaces `path` only if the block finished without an error
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.', suffix='.tmp')
+    try:
+        # mkstemp creates the file readable only by us. keep the permissions of the file being replaced
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o777)
+        except FileNotFoundError:
+            os.chmod(tmp_path, 0o644)
+        with open(fd, mode, **kwargs) as f:
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def atomic_write_json(path, data, encoding='utf-8', indent=None):
+    with atomic_write(path, 'w', encoding=encoding) as f:
+        json.dump(data, f, indent=indent)
@@ -0,0 +1,170 @@
+"""
+check the address parser on a generated corpus and compare its speed with the code it replaced.
+
+    python benchmarks/bench_address.py [--addresses 100000] [--seed 1]
+
+addresses are generated from random streets, numbers, floors and apartments. for every one of them
+    - split_floor and normalize return exactly what the old functions returned
+    - parse returns the parts the address was made from
+    - normalize gives the same key for the normalized string
+and the apartment floor of faktakontroll addresses without a floor marker is the one find_matches used
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import address  # noqa: E402
+
+STREETS = ['Götgatan', 'Sankt Eriksgatan', 'Storgatan', 'Ringvägen', 'Drottninggatan', 'Hälsingegatan',
+           'Östra Långgatan', 'Kungsholms strand', 'Vasaplan', 'Åsögatan']
+CITIES = ['Stockholm', 'Göteborg', 'Malmö', 'Uppsala']
+LETTERS = 'ABCDEF'
+
+
+def old_split_floor(full_address):
+    floor = None
+    floor_patterns = [r'\d{1,2} ?tr', r'vån ?\d{1,2}']
+    address_wo_floor = full_address.split(',')[0]
+    try:
+        for re_pattern in floor_patterns:
+            matches = re.findall(re_pattern, address_wo_floor)
+            if len(matches) > 0:
+                try:
+                    floor = int(re.findall(r'\d{1,2}', matches[0])[0])
+                    address_wo_floor = re.sub(re_pattern, '', address_wo_floor).strip()
+                    break
+                except Exception:
+                    pass
+    except Exception:
+        pass
+    if not floor:
+        for re_pattern in floor_patterns:
+            matches = re.findall(re_pattern, full_address)
+            if len(matches) > 0:
+                try:
+                    floor = int(re.findall(r'\d{1,2}', matches[0])[0])
+                    break
+                except Exception:
+                    pass
+    return address_wo_floor, floor
+
+
+def old_normalize_address(search_string):
+    parts = []
+    for part in search_string.split(','):
+        part, _ = old_split_floor(part.lower())
+        part = ' '.join(part.split())
+        if part:
+            parts.append(part)
+    return ', '.join(parts)
+
+
+def old_fk_floor_apartment(street_address):
+    """floor and apartment the way find_matches parsed them"""
+    if 'lgh' in street_address:
+        staddr = street_address[street_address.index('lgh'):]
+        try:
+            apartment = re.findall(r'\d{4}', staddr)[0]
+            floor = (int(apartment[0]) - 1) * 10 + int(apartment[1])
+        except:
+            apartment = None
+            floor = None
+    else:
+        floor = None
+        apartment = None
+    # never changed the floor, int() of the whole match always failed. kept for a fair timing
+    floor_patterns = [r'\d{1,2} ?tr', r'vån ?\d{1,2}']
+    for re_pattern in floor_patterns:
+        matches = re.findall(re_pattern, street_address)
+        if len(matches) > 0:
+            try:
+                floor = int(re.findall(re_pattern, matches[0])[0])
+                break
+            except Exception:
+                pass
+    return floor, apartment
+
+
+def make_corpus(count, seed):
+    """:return: list of (address, expected Address)"""
+    rnd = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        street = rnd.choice(STREETS)
+        number = str(rnd.randrange(1, 200))
+        if rnd.random() < 0.2:
+            number += rnd.choice(['', ' ']) + rnd.choice(LETTERS)
+        text = f'{street} {number}'
+
+        floor = None
+        if rnd.random() < 0.5:
+            floor = rnd.randrange(0, 20)
+            marker = rnd.choice([f'{floor} tr', f'{floor}tr', f'vån {floor}', f'vån{floor}'])
+            text += rnd.choice([' ', ', ']) + marker
+
+        apartment = None
+        if rnd.random() < 0.5:
+            apartment = f'{rnd.randrange(9, 30):02d}{rnd.randrange(1, 10):02d}'
+            text += f' lgh {apartment}'
+            if floor is None:
+                floor = address.apartment_floor(apartment)
+
+        if rnd.random() < 0.3:
+            text += f', {rnd.choice(CITIES)}'
+        corpus.append((text, address.Address(street, ' '.join(number.split()), floor, apartment)))
+    return corpus
+
+
+def check(corpus):
+    for text, expected in corpus:
+        assert address.split_floor(text) == old_split_floor(text), text
+        key = address.normalize(text)
+        assert key == old_normalize_address(text), text
+        assert address.normalize(key) == key, text
+        assert address.parse(text) == expected, (text, address.parse(text), expected)
+        if not any(pattern.search(text) for _, pattern in address.FLOOR_PATTERNS):
+            parsed = address.parse(text)
+            assert (parsed.floor, parsed.apartment) == old_fk_floor_apartment(text), text
+
+
+def rate(func, texts):
+    started_at = time.perf_counter()
+    func(texts)
+    return len(texts) / (time.perf_counter() - started_at)
+
+
+def compare(title, texts, old, new):
+    old_rate = rate(old, texts)
+    new_rate = rate(new, texts)
+    print(f'{title}: old {old_rate:10.0f} addresses/s, new {new_rate:10.0f} addresses/s, '
+          f'{new_rate / old_rate:4.1f}x faster')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--addresses', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.addresses, args.seed)
+    check(corpus)
+    print(f'{len(corpus)} generated addresses parsed as expected')
+
+    texts = [text for text, _ in corpus]
+    compare('split_floor', texts, lambda items: [old_split_floor(text) for text in items],
+            lambda items: [address.split_floor(text) for text in items])
+    compare('normalize  ', texts, lambda items: [old_normalize_address(text) for text in items],
+            address.normalize_many)
+    # parse also splits street and number, the old find_matches code only looked for the apartment
+    compare('fk address ', texts, lambda items: [old_fk_floor_apartment(text) for text in items],
+            address.parse_many)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+the config module for the benchmarks. the real config.py is used when there is one, otherwise a
+stub with a logger and caches in a temporary folder, enough to import the scripts' modules
+"""
+import os
+import sys
+import types
+import logging
+import tempfile
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def load_config(work_dir=None):
+    """:param work_dir: folder of the stub's caches and reports. a new temporary one by default"""
+    if BASE_DIR not in sys.path:
+        sys.path.insert(0, BASE_DIR)
+    try:
+        import config
+    except ImportError:
+        # no config.py on this machine
+        config = types.ModuleType('config')
+        config.logger = logging.getLogger()
+        work_dir = work_dir or tempfile.mkdtemp(prefix='hemnet-benchmark-')
+        config.CACHE_DIR = os.path.join(work_dir, 'cache')
+        config.DOC_DIR = os.path.join(work_dir, 'docs')
+        config.locations = []
+        sys.modules['config'] = config
+    return config
@@ -0,0 +1,66 @@
+"""
+compare the datalayer extractor with the regular expressions it replaced.
+
+    python benchmarks/bench_datalayer.py
+
+uses the listing and sold listing pages in benchmarks/fixtures
+"""
+import os
+import re
+import sys
+import json
+import timeit
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from datalayer import parse_property, parse_sold_property  # noqa: E402
+
+FIXTURES_DIR = os.path.join(BASE_DIR, 'benchmarks', 'fixtures')
+
+
+def old_get_details(content):
+    text = content.decode('utf-8')
+    datalayer_text = re.findall(r'dataLayer *?= *?.*?;', text)[0]
+    datalayer_text = datalayer_text[datalayer_text.index('['):-1]
+    for dl in json.loads(datalayer_text):
+        if dl.get('property'):
+            return dl['property']
+
+
+def old_get_sold_property_date(content):
+    text = content.decode('utf-8')
+    datalayer_text = re.findall(r'(?<=dataLayer = )(.*)(?=;)', text)[0]
+    prop_id, sold_date = None, 'date not found'
+    for dl in json.loads(datalayer_text):
+        if 'property' in dl.keys():
+            prop_id = str(dl['property']['id'])
+        if 'sold_property' in dl.keys():
+            sold_date = dl['sold_property']['sold_at_date']
+    return {'date': sold_date, 'id': prop_id}
+
+
+def compare(title, content, old, new, number=500):
+    old_time = timeit.timeit(lambda: old(content), number=number) / number
+    new_time = timeit.timeit(lambda: new(content), number=number) / number
+    print(f'{title}: old {old_time * 1e6:8.1f} us/page, new {new_time * 1e6:8.1f} us/page, '
+          f'{old_time / new_time:5.1f}x faster')
+
+
+def main():
+    with open(os.path.join(FIXTURES_DIR, 'listing_page.html'), 'rb') as f:
+        listing_page = f.read()
+    with open(os.path.join(FIXTURES_DIR, 'sold_listing_page.html'), 'rb') as f:
+        sold_listing_page = f.read()
+
+    # both versions have to find the same data
+    assert parse_property(listing_page).id == str(old_get_details(listing_page)['id'])
+    sold = parse_sold_property(sold_listing_page)
+    assert {'date': sold.sold_at_date, 'id': sold.property_id} == old_get_sold_property_date(sold_listing_page)
+
+    compare('get_details           ', listing_page, old_get_details, parse_property)
+    compare('get_sold_property_date', sold_listing_page, old_get_sold_property_date, parse_sold_property)
+
+
+if __name__ == '__main__':
+    main()
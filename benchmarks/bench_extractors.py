@@ -0,0 +1,101 @@
+"""
+compare the html extractor backends on saved pages.
+
+    python benchmarks/bench_extractors.py [page.html ...]
+
+without arguments every .html file in benchmarks/fixtures and bookmarks/ is used.
+reports pages/sec and peak memory of each backend and checks that all of them find the same links.
+the memory is the growth of the peak rss of a forked process over one pass, tracemalloc would miss
+the c heap of lxml (libxml2). linux only, other systems get the speed only
+"""
+import os
+import sys
+import glob
+import time
+import resource
+import multiprocessing
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+
+from bench_config import load_config  # noqa: E402
+load_config()
+from extractors import BACKENDS  # noqa: E402
+
+FIXTURES = glob.glob(os.path.join(BASE_DIR, 'benchmarks', 'fixtures', '*.html')) + \
+           glob.glob(os.path.join(BASE_DIR, 'bookmarks', '*.html'))
+
+
+def extract(extractor, content):
+    return extractor.listing_hits(content), extractor.sold_links(content)
+
+
+def measure_rss(name, pages, results):
+    # runs in a child forked before any backend parsed a page, so its peak rss only grows by this pass
+    extractor = BACKENDS[name]()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for content in pages:
+        extract(extractor, content)
+    results.put(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before)
+
+
+def peak_rss_growth(name, pages):
+    """:return: kB the peak rss grows by in one pass over the pages, None if it can't be measured here"""
+    if sys.platform != 'linux':
+        return None
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=measure_rss, args=(name, pages, results))
+    process.start()
+    growth = results.get()
+    process.join()
+    return growth
+
+
+def bench(extractor, pages, min_time=1.0):
+    count = 0
+    started_at = time.perf_counter()
+    while time.perf_counter() - started_at < min_time:
+        for content in pages:
+            extract(extractor, content)
+        count += len(pages)
+    elapsed = time.perf_counter() - started_at
+    return count / elapsed
+
+
+def main():
+    files = sys.argv[1:] or FIXTURES
+    pages = []
+    for file in files:
+        with open(file, 'rb') as f:
+            pages.append(f.read())
+    print(f'{len(pages)} pages, {sum(map(len, pages)) / 1024:.0f} kB')
+
+    # before the backends run in this process, their freed memory would be reused by the children
+    rss_growth = {}
+    for name in BACKENDS:
+        try:
+            rss_growth[name] = peak_rss_growth(name, pages)
+        except Exception:
+            rss_growth[name] = None
+
+    reference = None
+    for name, backend in BACKENDS.items():
+        try:
+            extractor = backend()
+            found = [extract(extractor, content) for content in pages]
+        except Exception as e:
+            print(f'{name:>5}: not available ({e})')
+            continue
+        if reference is None:
+            reference = found
+        elif found != reference:
+            print(f'{name:>5}: WARNING. links differ from the other backends')
+        pages_per_sec = bench(extractor, pages)
+        memory = 'n/a' if rss_growth[name] is None else f'{rss_growth[name]:.0f} kB'
+        print(f'{name:>5}: {pages_per_sec:8.1f} pages/s, peak rss +{memory}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+"""
+check the matching engine against the loop of find_matches it replaced and compare their speed.
+
+    python benchmarks/bench_matching.py [--buildings 200] [--hits 300] [--listings 20] [--seed 1]
+
+every generated building gets `--hits` faktakontroll hits and `--listings` hemnet listings, some with
+no area, no floor or a house type that matches everything. both must find the same hits with the
+same full_match flag for every listing. the engine is timed per listing and per building (match_many).
+the old loop reads the floors with the new address.parse, so only the area and floor comparison is checked
+against it, not the old floor parsing of find_matches
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+
+from bench_config import load_config  # noqa: E402
+load_config()
+import matching  # noqa: E402
+from address import parse_many  # noqa: E402
+from bench_address import STREETS  # noqa: E402
+
+HOUSE_TYPES = ['Lägenhet'] * 8 + ['Villa', 'Radhus']
+
+
+def old_match(hemnet_result, faktakontroll_results):
+    """
+    :return: [(position, full match)] the way find_matches compared the hits. the floors come from the new
+        address.parse, the old find_matches read them with its own parsing
+    """
+    matched = []
+    addresses = parse_many([result.get('fbfStreetAddress') or '' for result in faktakontroll_results])
+    for position, (result, address) in enumerate(zip(faktakontroll_results, addresses)):
+        if 'fbfStreetAddress' not in result:
+            continue
+        is_match = True
+        floor = address.floor
+        try:
+            area = result['housingInfo']['area']
+        except:
+            area = None
+        full_match = True
+        if hemnet_result.get('house_type') not in ['Radhus', 'Villa']:
+            try:
+                hemnet_area = float(hemnet_result.get('area'))
+            except:
+                hemnet_area = None
+            try:
+                faktakontroll_area = float(area)
+            except:
+                faktakontroll_area = None
+            if hemnet_area:
+                if not faktakontroll_area:
+                    is_match = False
+                elif hemnet_area == faktakontroll_area:
+                    pass
+                elif faktakontroll_area - 1 < hemnet_area < faktakontroll_area + 1:
+                    full_match = False
+                else:
+                    is_match = False
+            try:
+                hemnet_floor = int(hemnet_result['floor'])
+            except:
+                hemnet_floor = None
+            if hemnet_floor is not None:
+                if floor is None or floor < hemnet_floor - 1 or floor > hemnet_floor + 1:
+                    is_match = False
+        if is_match:
+            matched.append((position, full_match))
+    return matched
+
+
+def make_building(rnd, number, hits, listings):
+    street_address = f'{rnd.choice(STREETS)} {rnd.randrange(1, 200)}'
+    areas = [rnd.randrange(25, 140) + rnd.choice([0, 0, 0.5]) for _ in range(12)]
+    faktakontroll_results = []
+    for i in range(hits):
+        floor = rnd.randrange(0, 8)
+        text = f'{street_address} lgh {10 + floor:02d}{rnd.randrange(1, 10):02d}'
+        if rnd.random() < 0.1:
+            text = f'{street_address}, {floor} tr'
+        hit = {'id': f'{number}-{i}', 'firstNames': 'Anna', 'lastNames': 'Svensson', 'fbfStreetAddress': text,
+               'housingInfo': {'area': rnd.choice(areas)}}
+        if rnd.random() < 0.05:
+            hit['housingInfo'] = {}
+        if rnd.random() < 0.02:
+            del hit['fbfStreetAddress']
+        faktakontroll_results.append(hit)
+
+    hemnet_results = []
+    for _ in range(listings):
+        area = rnd.choice(areas) + rnd.choice([0, 0, 0.5, -0.5, 2])
+        hemnet_results.append({
+            'street_address': street_address,
+            'house_type': rnd.choice(HOUSE_TYPES),
+            'area': None if rnd.random() < 0.1 else area,
+            'floor': None if rnd.random() < 0.1 else str(rnd.randrange(0, 8)),
+        })
+    return faktakontroll_results, hemnet_results
+
+
+def timed(func, buildings):
+    started_at = time.perf_counter()
+    for faktakontroll_results, hemnet_results in buildings:
+        func(faktakontroll_results, hemnet_results)
+    return time.perf_counter() - started_at
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--buildings', type=int, default=200)
+    parser.add_argument('--hits', type=int, default=300)
+    parser.add_argument('--listings', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    buildings = [make_building(rnd, number, args.hits, args.listings) for number in range(args.buildings)]
+    compared = 0
+    for faktakontroll_results, hemnet_results in buildings:
+        index = matching.HitIndex(faktakontroll_results)
+        for hemnet_result, scored in zip(hemnet_results, index.match_many(hemnet_results)):
+            # positions of the index skip the hits without an address
+            positions = [faktakontroll_results.index(index.hits[position]) for position, _ in scored]
+            assert list(zip(positions, [full for _, full in scored])) == \
+                old_match(hemnet_result, faktakontroll_results), hemnet_result
+            compared += 1
+    print(f'{compared} listings matched the same way. numpy: {"yes" if matching.np is not None else "no"}')
+
+    listings = args.buildings * args.listings
+    old_time = timed(lambda hits, results: [old_match(result, hits) for result in results], buildings)
+    # find_matches gets the hits of every listing from a new search (or the cache) and looks up the index
+    single_time = timed(lambda hits, results: [matching.get_index([dict(hit) for hit in hits]).match(result)
+                                               for result in results], buildings)
+    many_time = timed(lambda hits, results: matching.HitIndex(hits).match_many(results), buildings)
+    print(f'old loop:              {listings / old_time:10.0f} listings/s')
+    print(f'get_index per listing: {listings / single_time:10.0f} listings/s, {old_time / single_time:5.1f}x faster')
+    print(f'index per building:    {listings / many_time:10.0f} listings/s, {old_time / many_time:5.1f}x faster')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+compare the listing records with the plain dicts they replaced on a synthetic result cache.
+
+    python benchmarks/bench_records.py [--listings 500000]
+
+the cache is written the way JsonStorage used to write it (json.dump, utf-8 with a byte order mark).
+load time, memory of the loaded cache and save time are measured for both
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import records  # noqa: E402
+
+CITIES = [f'City {i}' for i in range(60)]
+HOUSE_TYPES = ['Lägenhet', 'Villa', 'Radhus', 'Parhus', 'Fritidshus']
+
+
+def make_match(rnd):
+    return {
+        'full_match': rnd.random() < 0.7,
+        'numbers': [f'07{rnd.randrange(10 ** 8):08d}' for _ in range(rnd.randrange(3))],
+        'age': rnd.randrange(20, 90),
+        'gender': rnd.choice(['M', 'F']),
+        'person_number': f'19{rnd.randrange(10 ** 10):010d}',
+        'area': rnd.randrange(20, 150),
+        'name': f'Förnamn{rnd.randrange(1000)} Efternamn{rnd.randrange(1000)}',
+        'floor': rnd.randrange(10),
+        'apartment': f'{rnd.randrange(1000, 2000)}',
+        'street_address': f'Gatan {rnd.randrange(100)} lgh {rnd.randrange(1000, 2000)}',
+    }
+
+
+def make_cache(count, seed=1):
+    rnd = random.Random(seed)
+    results = {}
+    for i in range(count):
+        property_id = str(10000000 + i)
+        complete = rnd.random() < 0.6
+        results[property_id] = {
+            'id': property_id,
+            'url': f'https://www.hemnet.se/bostad/lagenhet-2rum-gatan-{property_id}',
+            'city': rnd.choice(CITIES),
+            'street_address': f'Gatan {rnd.randrange(100)}',
+            'floor': str(rnd.randrange(10)),
+            'area': rnd.randrange(20, 150),
+            'house_type': rnd.choice(HOUSE_TYPES),
+            'extra_area': None,
+            'publication_date': '2021-05-01',
+            'complete': complete,
+            'sold_date': '',
+            'matches': [make_match(rnd) for _ in range(rnd.randrange(4))] if complete else None,
+            'try_count': 1 if complete else 0,
+        }
+    return results
+
+
+def old_load(path):
+    with open(path, encoding='utf-8-sig') as f:
+        return json.load(f)
+
+
+def new_load(path):
+    with open(path, 'rb') as f:
+        return records.load_listings(f.read())
+
+
+def old_save(path, results):
+    with open(path, 'w', encoding='utf-8-sig') as f:
+        json.dump(results, f)
+
+
+def new_save(path, results):
+    with open(path, 'wb') as f:
+        f.write(records.UTF8_BOM + records.dumps(results))
+
+
+def timed(func, *args):
+    started_at = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started_at
+
+
+def loaded_size(load, path):
+    """bytes allocated by loading the cache that are still alive afterwards"""
+    tracemalloc.start()
+    results = load(path)
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del results
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--listings', type=int, default=500000)
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='hemnet-records-')
+    path = os.path.join(work_dir, 'cache.json')
+    old_save(path, make_cache(args.listings))
+    print(f'{args.listings} listings, {os.path.getsize(path) / 1024 / 1024:.0f} MB cache. '
+          f'codec: {"orjson" if records.orjson else "json"}')
+
+    dicts, old_load_time = timed(old_load, path)
+    listings, new_load_time = timed(new_load, path)
+    # the records have to hold exactly what the dicts held
+    assert len(dicts) == len(listings)
+    for property_id in random.Random(2).sample(list(dicts), 1000):
+        assert json.loads(json.dumps(listings[property_id], default=records.plain)) == dicts[property_id]
+
+    _, old_save_time = timed(old_save, path + '.old', dicts)
+    _, new_save_time = timed(new_save, path + '.new', listings)
+    assert old_load(path + '.new') == dicts
+    del dicts, listings
+
+    old_size = loaded_size(old_load, path)
+    new_size = loaded_size(new_load, path)
+
+    print(f'load:   dicts {old_load_time:6.2f}s, records {new_load_time:6.2f}s, '
+          f'{old_load_time / new_load_time:4.1f}x faster')
+    print(f'save:   dicts {old_save_time:6.2f}s, records {new_save_time:6.2f}s, '
+          f'{old_save_time / new_save_time:4.1f}x faster')
+    print(f'memory: dicts {old_size / 1024 / 1024:6.0f} MB, records {new_size / 1024 / 1024:4.0f} MB, '
+          f'{old_size / new_size:4.1f}x smaller')
+    for name in os.listdir(work_dir):
+        os.remove(os.path.join(work_dir, name))
+    os.rmdir(work_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+"""
+local stand-in for hemnet and faktakontroll built from the pages in benchmarks/fixtures.
+
+    python benchmarks/replay_server.py [--port 8800] [--latency 50] [--failure-rate 0.01]
+
+serves:
+    GET  /bostader?page=N                  search result pages with `--listings-per-page` listings
+    GET  /bostad/<slug>-<id>               listing page of <id>
+    GET  /salda/bostader?page=N            sold result pages
+    GET  /salda/<slug>-<id>                sold listing page of <id>
+    POST /getToken                         faktakontroll token
+    POST /app/api/search                   faktakontroll search hits
+    GET  /app/api/search/entity/<id>       faktakontroll person details
+
+every response is delayed by `--latency` ms (+- `--jitter` ms) and answered with a 500 error with
+probability `--failure-rate`
+"""
+import os
+import re
+import json
+import html
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+# listing ids of the search pages. page N holds ids FIRST_ID + (N - 1) * per page ...
+FIRST_ID = 20000000
+FIXTURE_PROPERTY_ID = b'17339563'
+
+
+def read_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), 'rb') as f:
+        return f.read()
+
+
+class Site:
+    """the pages served, generated once from the fixtures"""
+
+    def __init__(self, base_url, pages, listings_per_page):
+        self.base_url = base_url
+        self.pages = pages
+        self.listings_per_page = listings_per_page
+        self.listing_page = read_fixture('listing_page.html')
+        self.sold_listing_page = read_fixture('sold_listing_page.html')
+        self.fk_search = read_fixture('faktakontroll_search.json')
+        self.fk_entity = read_fixture('faktakontroll_entity.json')
+
+    def page_ids(self, page):
+        if page < 1 or page > self.pages:
+            return []
+        first = FIRST_ID + (page - 1) * self.listings_per_page
+        return list(range(first, first + self.listings_per_page))
+
+    def search_page(self, page):
+        items = []
+        for property_id in self.page_ids(page):
+            info = html.escape(json.dumps({'id': str(property_id)}), quote=True)
+            items.append(f'<li class="normal-results__hit js-normal-list-item" data-gtm-item-info="{info}">'
+                         f'<a class="listing-card__link" href="{self.base_url}/bostad/lagenhet-2rum-{property_id}">'
+                         f'<h2 class="listing-card__street-address">Götgatan 48, 3 tr</h2></a></li>')
+        return self.wrap(items, 'normal-results')
+
+    def sold_page(self, page):
+        items = [f'<li class="sold-results__normal-hit"><a class="sold-property-listing" '
+                 f'href="{self.base_url}/salda/lagenhet-2rum-{property_id}"><h2>Götgatan 48</h2></a></li>'
+                 for property_id in self.page_ids(page)]
+        return self.wrap(items, 'sold-results')
+
+    @staticmethod
+    def wrap(items, list_class):
+        return ('<!DOCTYPE html><html lang="sv"><head><meta charset="utf-8"><title>Hemnet</title></head>'
+                f'<body><main><ul class="{list_class}">' + '\n'.join(items) + '</ul></main></body></html>').encode()
+
+    def listing(self, property_id):
+        return self.listing_page.replace(FIXTURE_PROPERTY_ID, property_id.encode())
+
+    def sold_listing(self, property_id):
+        return self.sold_listing_page.replace(FIXTURE_PROPERTY_ID, property_id.encode())
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are written separately. without this every keep-alive response waits for a delayed ack
+    disable_nagle_algorithm = True
+    site = None
+    latency = 0.0
+    jitter = 0.0
+    failure_rate = 0.0
+    request_count = 0
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type='text/html; charset=utf-8'):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def respond(self):
+        with Handler.lock:
+            Handler.request_count += 1
+        delay = max(self.latency + random.uniform(-self.jitter, self.jitter), 0)
+        if delay:
+            time.sleep(delay)
+        if random.random() < self.failure_rate:
+            return self.send(500, b'injected failure', 'text/plain')
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        page = int(query.get('page', ['1'])[0])
+        path = url.path
+        if self.command == 'POST':
+            # the body is not used, but has to be read to keep the connection usable
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if path == '/getToken':
+                return self.send(200, b'{"accessToken": "replay-token", "validFor": 3600}', 'application/json')
+            if path == '/app/api/search':
+                return self.send(200, self.site.fk_search, 'application/json')
+        else:
+            if path == '/bostader':
+                return self.send(200, self.site.search_page(page))
+            if path == '/salda/bostader':
+                return self.send(200, self.site.sold_page(page))
+            match = re.match(r'/bostad/.*-(\d+)$', path)
+            if match:
+                return self.send(200, self.site.listing(match.group(1)))
+            match = re.match(r'/salda/.*-(\d+)$', path)
+            if match:
+                return self.send(200, self.site.sold_listing(match.group(1)))
+            if path.startswith('/app/api/search/entity/'):
+                return self.send(200, self.site.fk_entity, 'application/json')
+        self.send(404, b'not found', 'text/plain')
+
+    do_GET = respond
+    do_POST = respond
+
+
+def start_server(port=0, latency_ms=0, jitter_ms=0, failure_rate=0.0, pages=5, listings_per_page=50):
+    """start the server on a background thread. :return: (server, base url)"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    Handler.site = Site(base_url, pages, listings_per_page)
+    Handler.latency = latency_ms / 1000
+    Handler.jitter = jitter_ms / 1000
+    Handler.failure_rate = failure_rate
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, base_url
+
+
+def add_arguments(parser):
+    parser.add_argument('--latency', type=float, default=0, help='response delay in ms')
+    parser.add_argument('--jitter', type=float, default=0, help='random +- change of the delay in ms')
+    parser.add_argument('--failure-rate', type=float, default=0, help='share of requests answered with a 500')
+    parser.add_argument('--pages', type=int, default=5, help='number of search result pages')
+    parser.add_argument('--listings-per-page', type=int, default=50)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8800)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server, base_url = start_server(args.port, args.latency, args.jitter, args.failure_rate,
+                                    args.pages, args.listings_per_page)
+    print(f'serving on {base_url}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+run the hemnet, faktakontroll and sold pipelines end to end against the local replay server.
+
+    python benchmarks/run_benchmarks.py [--latency 50] [--failure-rate 0.01] [--concurrency 4] [--output FILE]
+
+everything is written to a temporary folder, so the real caches are never touched and every run
+starts cold. reports throughput and cpu time per pipeline, p50/p99 latency per stage and peak rss.
+results are saved as json (benchmarks/results/<time>.json by default) to compare runs
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import resource
+import tempfile
+import datetime
+import functools
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+import replay_server  # noqa: E402
+from bench_config import load_config  # noqa: E402
+
+RESULTS_DIR = os.path.join(BASE_DIR, 'benchmarks', 'results')
+LOCATION = {'id': '999999', 'location': 'Benchmark'}
+
+
+def setup_config(work_dir, base_url, args):
+    """point the config at the replay server and the temporary folder before anything else imports it"""
+    # everything the scripts need is set below when there is no config.py on this machine
+    config = load_config(work_dir)
+    logging.basicConfig()
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    config.CACHE_DIR = os.path.join(work_dir, 'cache')
+    config.DOC_DIR = os.path.join(work_dir, 'docs')
+    config.locations = [LOCATION]
+    config.hemnet_url = base_url
+    config.faktakontroll_url = base_url
+    config.host = base_url
+    config.fk_api_key = 'benchmark'
+    config.fk_max_retry = 3
+    config.max_results = getattr(config, 'max_results', 20)
+    config.faktakontroll_limited = False
+    config.sleep_between_searches = lambda: None
+    config.sleep_between_each_person = lambda: None
+    config.fetch_concurrency = args.concurrency
+    config.http_cache = False
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    return config
+
+
+class StageTimer:
+    """collects the duration of every call of the wrapped methods"""
+
+    def __init__(self):
+        self.durations = {}
+
+    def wrap(self, cls, method_name, stage):
+        method = getattr(cls, method_name)
+        durations = self.durations.setdefault(stage, [])
+
+        @functools.wraps(method)
+        def timed(*args, **kwargs):
+            started_at = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                durations.append(time.perf_counter() - started_at)
+
+        setattr(cls, method_name, timed)
+
+    def report(self):
+        report = {}
+        for stage, durations in self.durations.items():
+            if not durations:
+                continue
+            values = sorted(durations)
+            report[stage] = {
+                'count': len(values),
+                'total_seconds': sum(values),
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p50_ms': percentile(values, 0.5) * 1000,
+                'p99_ms': percentile(values, 0.99) * 1000,
+            }
+        return report
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(round(q * (len(sorted_values) - 1))))]
+
+
+def measure(name, func):
+    wall_started_at, cpu_started_at = time.perf_counter(), time.process_time()
+    items = func()
+    wall, cpu = time.perf_counter() - wall_started_at, time.process_time() - cpu_started_at
+    result = {'items': items, 'wall_seconds': wall, 'cpu_seconds': cpu, 'items_per_second': items / wall if wall else 0}
+    print(f'{name:>14}: {items:5d} items in {wall:7.2f}s ({result["items_per_second"]:7.1f}/s), cpu {cpu:6.2f}s')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    replay_server.add_arguments(parser)
+    parser.add_argument('--concurrency', type=int, default=1, help='hemnet fetch concurrency')
+    parser.add_argument('--lookups', type=int, default=100, help='maximum faktakontroll lookups')
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--verbose', action='store_true', help='keep the debug logging of the scripts')
+    args = parser.parse_args()
+
+    server, base_url = replay_server.start_server(0, args.latency, args.jitter, args.failure_rate,
+                                                  args.pages, args.listings_per_page)
+    work_dir = tempfile.mkdtemp(prefix='hemnet-benchmark-')
+    setup_config(work_dir, base_url, args)
+
+    import utils
+    import export
+    import fetcher
+    import search_hemnet
+    import search_faktakontroll
+    from work_queue import PendingQueue
+
+    timer = StageTimer()
+    timer.wrap(utils.Hemnet, 'search', 'hemnet_search')
+    timer.wrap(fetcher.ConcurrentFetcher, 'get', 'hemnet_request')
+    timer.wrap(utils.Hemnet, 'parse_details', 'parse_details')
+    timer.wrap(utils.Hemnet, 'save_results', 'save')
+    timer.wrap(utils.Faktakontroll, 'search', 'faktakontroll_search')
+    timer.wrap(utils.Faktakontroll, 'find_matches', 'find_matches')
+    timer.wrap(utils.Faktakontroll, 'get_more_details', 'faktakontroll_details')
+    timer.wrap(search_faktakontroll.Worker, 'save_results', 'faktakontroll_save')
+    timer.wrap(utils.Hemnet, 'search_sold_properties', 'sold_search')
+    timer.wrap(utils.Hemnet, 'get_sold_property_date', 'sold_date')
+    timer.wrap(export.Exporter, 'export', 'export')
+
+    def hemnet_pipeline():
+        hemnet = utils.Hemnet(LOCATION)
+        search_hemnet.run(hemnet, PendingQueue())
+        return len(hemnet.results)
+
+    def faktakontroll_pipeline():
+        worker = search_faktakontroll.Worker()
+        lookups = 0
+        while lookups < args.lookups and worker.step() == 0:
+            lookups += 1
+        worker.save_results()
+        worker.exporter.flush(force=True)
+        return lookups
+
+    def sold_pipeline():
+        hemnet = utils.Hemnet(LOCATION)
+        links = hemnet.search_sold_properties()
+        for link in links:
+            hemnet.get_sold_property_date(link)
+        return len(links)
+
+    print(f'replay server on {base_url}. latency {args.latency}ms, failure rate {args.failure_rate}')
+    pipelines = {
+        'hemnet': measure('hemnet', hemnet_pipeline),
+        'faktakontroll': measure('faktakontroll', faktakontroll_pipeline),
+        'hemnet_sold': measure('hemnet_sold', sold_pipeline),
+    }
+    stages = timer.report()
+    for stage, stats in stages.items():
+        print(f'{stage:>22}: {stats["count"]:5d} calls, p50 {stats["p50_ms"]:8.2f}ms, p99 {stats["p99_ms"]:8.2f}ms')
+    # ru_maxrss is in kB on linux
+    peak_rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f'peak rss: {peak_rss_kb / 1024:.0f} MB, {replay_server.Handler.request_count} requests served')
+
+    results = {
+        'time': datetime.datetime.now().isoformat(timespec='seconds'),
+        'arguments': vars(args),
+        'pipelines': pipelines,
+        'stages': stages,
+        'peak_rss_kb': peak_rss_kb,
+        'requests_served': replay_server.Handler.request_count,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f'{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}.json')
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f'results saved as: {output}')
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
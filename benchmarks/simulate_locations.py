@@ -0,0 +1,104 @@
+"""
+replay the recorded location stats to compare round-robin with the yield based location choice.
+
+    python benchmarks/simulate_locations.py [search|sold|faktakontroll] [--hours N] [--demo]
+
+the rate at which every location produces new results and the requests a visit costs are estimated
+from the runs in location-stats.db. both strategies then get the same number of visits and the
+results found per request are compared. results not collected in time are lost at a rate set by
+--lifetime (listings that are sold or removed before we see them).
+--demo uses made up locations instead of the recorded runs
+"""
+import os
+import sys
+import math
+import random
+import argparse
+from collections import defaultdict
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+sys.path.insert(0, os.path.join(BASE_DIR, 'benchmarks'))
+
+from bench_config import load_config  # noqa: E402
+load_config()
+from location_stats import LocationStats, priority, YIELD_SMOOTHING  # noqa: E402
+
+
+def estimate(runs):
+    """:return: {location_id: (results per hour, requests per visit)}"""
+    by_location = defaultdict(list)
+    for location_id, at, requests, found in runs:
+        by_location[location_id].append((at, requests, found))
+    estimates = {}
+    for location_id, location_runs in by_location.items():
+        span_hours = max((location_runs[-1][0] - location_runs[0][0]) / 3600, 1)
+        found = sum(run[2] for run in location_runs[1:]) or sum(run[2] for run in location_runs)
+        requests_per_visit = sum(run[1] for run in location_runs) / len(location_runs)
+        estimates[location_id] = (found / span_hours, max(requests_per_visit, 1))
+    return estimates
+
+
+def demo_estimates(count=30):
+    random.seed(1)
+    # a few busy locations and many quiet ones
+    return {str(i): (random.paretovariate(1.2) * 0.5, random.randint(2, 6)) for i in range(count)}
+
+
+def simulate(estimates, hours, visits_per_hour, adaptive, lifetime):
+    now = 0.0
+    pending = {location_id: 0.0 for location_id in estimates}
+    last_visit = {location_id: 0.0 for location_id in estimates}
+    stats = {}
+    order = sorted(estimates)
+    total_found = total_requests = 0
+    survival = math.exp(-1 / (visits_per_hour * lifetime))
+    for visit in range(int(hours * visits_per_hour)):
+        now = (visit + 1) / visits_per_hour * 3600
+        for location_id, (rate, _) in estimates.items():
+            pending[location_id] = pending[location_id] * survival + rate / visits_per_hour
+        if adaptive:
+            location_id = max(order, key=lambda loc: priority(*stats.get(loc, (0, 0)), now))
+        else:
+            location_id = order[visit % len(order)]
+        found = pending[location_id]
+        requests = estimates[location_id][1] + found
+        pending[location_id] = 0
+        run_yield = found / requests
+        old = stats.get(location_id)
+        new_yield = run_yield if old is None else YIELD_SMOOTHING * run_yield + (1 - YIELD_SMOOTHING) * old[0]
+        stats[location_id] = (new_yield, now)
+        last_visit[location_id] = now
+        total_found += found
+        total_requests += requests
+    starved = max(now - visited for visited in last_visit.values()) / 3600
+    return total_found, total_requests, starved
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('kind', nargs='?', default='search')
+    parser.add_argument('--hours', type=float, default=24 * 7)
+    parser.add_argument('--visits-per-hour', type=float, default=4)
+    parser.add_argument('--lifetime', type=float, default=72, help='average hours a result can be found')
+    parser.add_argument('--demo', action='store_true')
+    args = parser.parse_args()
+
+    estimates = demo_estimates() if args.demo else estimate(LocationStats().runs(args.kind))
+    if not estimates:
+        print(f'no recorded runs for "{args.kind}". run the scripts for a while or use --demo')
+        return
+    print(f'{len(estimates)} locations, {args.hours:.0f} hours, {args.visits_per_hour} visits per hour')
+    found_by_strategy = {}
+    for name, adaptive in (('round-robin', False), ('yield based', True)):
+        found, requests, starved = simulate(estimates, args.hours, args.visits_per_hour, adaptive,
+                                           args.lifetime)
+        found_by_strategy[name] = found
+        print(f'{name:>12}: {found:8.0f} results, {requests:8.0f} requests, {found / requests:.3f} results/request, '
+              f'longest unvisited {starved:.1f}h')
+    gain = found_by_strategy['yield based'] / found_by_strategy['round-robin'] - 1
+    print(f'yield based finds {gain:+.1%} results')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,374 @@
+"""
+bulk export of the matched results of all locations, for analysis outside of excel.
+
+the rows have the columns of the xlsx reports (export.HEADERS) and are written as csv, parquet
+or arrow ipc files, partitioned by location:
+
+    <bulk_export_dir>/<format>/location_id=<id>/part-00001.<csv|parquet|arrow>
+
+    python bulk_export.py [--format csv parquet arrow] [--location ID] [--full]
+
+every run appends one part per location with the listings whose rows changed since the last run
+(new matches, a sold date, ...). a listing exported again is in a later part, the rows of its
+latest part are the current ones. a listing that has no rows anymore (its matches were cleared,
+it was removed, ...) gets a single row with only the Id and Deleted set, so the rows in the older
+parts are known to be stale. --full writes every listing of a location into a new part
+and removes the older ones.
+
+the listings are read from the result store one at a time and written in batches of
+`bulk_export_batch_rows` rows. the exported ids and fingerprints are compared in sqlite, so memory
+doesn't grow with the number of rows or listings.
+parquet and arrow need pyarrow, csv is always available
+"""
+import os
+import csv
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import contextlib
+import config
+import metrics
+import profiling
+from storage import get_storage
+from export import HEADERS, entry_rows
+from atomic_io import atomic_write
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = config.logger
+
+BULK_EXPORT_DB_NAME = 'bulk-export.db'
+BULK_EXPORT_FORMATS = list(getattr(config, 'bulk_export_formats', ['csv', 'parquet']))
+# rows kept in memory before they are written to the parts
+BULK_EXPORT_BATCH_ROWS = getattr(config, 'bulk_export_batch_rows', 10000)
+
+BULK_EXPORT_ROWS = metrics.counter('scraper_bulk_export_rows_total', 'rows written by the bulk export', ['format'])
+
+# the columns of the reports and whether the row marks a listing without rows anymore
+BULK_HEADERS = HEADERS + ['Deleted']
+# type of every column of BULK_HEADERS in parquet and arrow. the reports leave missing values empty,
+# those are nulls here
+COLUMN_TYPES = ['str', 'int', 'int', 'str', 'str', 'str', 'float', 'float', 'int', 'str', 'str', 'str',
+                'int'] + ['str'] * 6 + ['str', 'str', 'str', 'str', 'bool']
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except:
+        return None
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except:
+        return None
+
+
+def to_str(value):
+    return None if value is None else str(value)
+
+
+CONVERTERS = {'str': to_str, 'int': to_int, 'float': to_float, 'bool': bool}
+
+
+def arrow_schema():
+    types = {'str': pyarrow.string(), 'int': pyarrow.int64(), 'float': pyarrow.float64(), 'bool': pyarrow.bool_()}
+    return pyarrow.schema([(name, types[kind]) for name, kind in zip(BULK_HEADERS, COLUMN_TYPES)])
+
+
+def to_record_batch(rows, schema):
+    columns = []
+    for i, kind in enumerate(COLUMN_TYPES):
+        convert = CONVERTERS[kind]
+        columns.append(pyarrow.array([convert(row[i]) for row in rows], type=schema.field(i).type))
+    return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+class CsvPart:
+    extension = 'csv'
+    mode = 'w'
+    open_kwargs = {'encoding': 'utf-8', 'newline': ''}
+
+    def __init__(self, f):
+        self.writer = csv.writer(f)
+        self.writer.writerow(BULK_HEADERS)
+
+    def write(self, rows):
+        self.writer.writerows(['' if value is None else value for value in row] for row in rows)
+
+    def close(self):
+        pass
+
+
+class ParquetPart:
+    extension = 'parquet'
+    mode = 'wb'
+    open_kwargs = {}
+
+    def __init__(self, f):
+        self.schema = arrow_schema()
+        self.writer = pyarrow.parquet.ParquetWriter(f, self.schema)
+
+    def write(self, rows):
+        self.writer.write_batch(to_record_batch(rows, self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowPart:
+    extension = 'arrow'
+    mode = 'wb'
+    open_kwargs = {}
+
+    def __init__(self, f):
+        self.schema = arrow_schema()
+        self.writer = pyarrow.ipc.new_file(f, self.schema)
+
+    def write(self, rows):
+        self.writer.write_batch(to_record_batch(rows, self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+FORMATS = {
+    'csv': CsvPart,
+    'parquet': ParquetPart,
+    'arrow': ArrowPart,
+}
+ARROW_FORMATS = {'parquet', 'arrow'}
+
+
+def rows_fingerprint(rows):
+    return hashlib.sha1(json.dumps(rows, default=str).encode()).hexdigest()
+
+
+def deleted_row(property_id):
+    return [property_id] + [None] * (len(HEADERS) - 1) + [True]
+
+
+class BulkExporter:
+    """
+    remembers the fingerprint of the rows of every exported listing and the parts written,
+    for every format and location
+    """
+
+    def __init__(self, formats=None, export_dir=None, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, BULK_EXPORT_DB_NAME)
+        formats = list(formats or BULK_EXPORT_FORMATS)
+        if pyarrow is None and ARROW_FORMATS.intersection(formats):
+            logger.warning(f'pyarrow is not installed. {", ".join(sorted(ARROW_FORMATS.intersection(formats)))} '
+                           f'export skipped')
+            formats = [name for name in formats if name not in ARROW_FORMATS]
+        self.formats = formats
+        self.export_dir = export_dir or getattr(config, 'bulk_export_dir', os.path.join(config.DOC_DIR, 'bulk'))
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS exported (
+                    format TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    PRIMARY KEY (format, location_id, id)
+                )
+            ''')
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS parts (
+                    format TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    part INTEGER NOT NULL,
+                    path TEXT NOT NULL,
+                    row_count INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (format, location_id, part)
+                )
+            ''')
+            # parts of older versions were written without the Deleted column
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(parts)')]
+            if 'has_deleted' not in columns:
+                self.conn.execute('ALTER TABLE parts ADD COLUMN has_deleted INTEGER NOT NULL DEFAULT 0')
+        # the ids found in the store and the rows written by the running export
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS listed (id TEXT PRIMARY KEY)')
+        self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS written '
+                          '(format TEXT NOT NULL, id TEXT NOT NULL, fingerprint TEXT, PRIMARY KEY (format, id))')
+
+    def partition_dir(self, name, location_id):
+        return os.path.join(self.export_dir, name, f'location_id={location_id}')
+
+    def fingerprint(self, name, location_id, property_id):
+        row = self.conn.execute('SELECT fingerprint FROM exported WHERE format = ? AND location_id = ? AND id = ?',
+                                (name, location_id, property_id)).fetchone()
+        return row[0] if row else None
+
+    def vanished(self, name, location_id):
+        """the exported ids of the location that were not found in the store by the running export"""
+        return self.conn.execute('SELECT id FROM exported WHERE format = ? AND location_id = ? '
+                                 'AND id NOT IN (SELECT id FROM temp.listed)', (name, location_id))
+
+    def has_old_parts(self, name, location_id):
+        return self.conn.execute('SELECT 1 FROM parts WHERE format = ? AND location_id = ? AND has_deleted = 0',
+                                 (name, location_id)).fetchone() is not None
+
+    def next_part(self, name, location_id):
+        row = self.conn.execute('SELECT MAX(part) FROM parts WHERE format = ? AND location_id = ?',
+                                (name, str(location_id))).fetchone()
+        return (row[0] or 0) + 1
+
+    @profiling.stage('bulk_export')
+    def export(self, location_id, storage=None, full=False):
+        """
+        append a part with the listings of the location whose rows changed, for every format
+        :return: {format: number of rows written}
+        """
+        storage = storage or get_storage()
+        location_id = str(location_id)
+        # the older parts of a format without the Deleted column are replaced as a whole
+        full_formats = {name for name in self.formats if full or self.has_old_parts(name, location_id)}
+        parts = {}
+        paths = {}
+        row_counts = {name: 0 for name in self.formats}
+        batches = {name: [] for name in self.formats}
+        listed = []
+        self.conn.execute('DELETE FROM temp.listed')
+        self.conn.execute('DELETE FROM temp.written')
+
+        try:
+            with contextlib.ExitStack() as stack:
+                def flush(name):
+                    if name not in parts:
+                        # the part is only created once there is something to write in it
+                        part = self.next_part(name, location_id)
+                        paths[name] = os.path.join(self.partition_dir(name, location_id),
+                                                   f'part-{part:05d}.{FORMATS[name].extension}')
+                        f = stack.enter_context(atomic_write(paths[name], FORMATS[name].mode,
+                                                             **FORMATS[name].open_kwargs))
+                        parts[name] = (part, FORMATS[name](f))
+                    parts[name][1].write([row for row, _ in batches[name]])
+                    row_counts[name] += len(batches[name])
+                    self.conn.executemany('INSERT OR REPLACE INTO temp.written (format, id, fingerprint) '
+                                          'VALUES (?, ?, ?)',
+                                          {(name, property_id, fingerprint)
+                                           for _, (property_id, fingerprint) in batches[name]})
+                    batches[name] = []
+
+                def add(name, rows, property_id, fingerprint):
+                    batches[name].extend((row, (property_id, fingerprint)) for row in rows)
+                    if len(batches[name]) >= BULK_EXPORT_BATCH_ROWS:
+                        flush(name)
+
+                for property_id, entry in storage.iter_listings(location_id):
+                    property_id = str(property_id)
+                    rows = entry_rows(property_id, entry)
+                    if not rows:
+                        continue
+                    listed.append((property_id,))
+                    if len(listed) >= BULK_EXPORT_BATCH_ROWS:
+                        self.conn.executemany('INSERT OR IGNORE INTO temp.listed (id) VALUES (?)', listed)
+                        listed = []
+                    fingerprint = rows_fingerprint(rows)
+                    for name in self.formats:
+                        if name not in full_formats and self.fingerprint(name, location_id, property_id) == fingerprint:
+                            continue
+                        add(name, [row + [False] for row in rows], property_id, fingerprint)
+                self.conn.executemany('INSERT OR IGNORE INTO temp.listed (id) VALUES (?)', listed)
+
+                # the listings exported before that have no rows anymore
+                for name in self.formats:
+                    if name not in full_formats:
+                        for property_id, in self.vanished(name, location_id):
+                            add(name, [deleted_row(property_id)], property_id, None)
+                    if batches[name]:
+                        flush(name)
+                # the writers have to finish their files before atomic_write renames them into place
+                for _, writer in parts.values():
+                    writer.close()
+        except:
+            self.conn.rollback()
+            raise
+
+        now = time.time()
+        with self.conn:
+            for name in full_formats:
+                self.conn.execute('DELETE FROM exported WHERE format = ? AND location_id = ?', (name, location_id))
+            for name, (part, _) in parts.items():
+                self.conn.execute('INSERT OR REPLACE INTO exported (format, location_id, id, fingerprint) '
+                                  'SELECT format, ?, id, fingerprint FROM temp.written '
+                                  'WHERE format = ? AND fingerprint IS NOT NULL', (location_id, name))
+                self.conn.execute('DELETE FROM exported WHERE format = ? AND location_id = ? AND id IN '
+                                  '(SELECT id FROM temp.written WHERE format = ? AND fingerprint IS NULL)',
+                                  (name, location_id, name))
+                self.conn.execute('INSERT INTO parts (format, location_id, part, path, row_count, created_at, '
+                                  'has_deleted) VALUES (?, ?, ?, ?, ?, ?, 1)',
+                                  (name, location_id, part, paths[name], row_counts[name], now))
+                BULK_EXPORT_ROWS.inc(row_counts[name], format=name)
+                logger.info(f'{row_counts[name]} rows of location {location_id} saved as: {paths[name]}')
+            self.conn.execute('DELETE FROM temp.listed')
+            self.conn.execute('DELETE FROM temp.written')
+        for name in full_formats:
+            self.remove_parts_before(name, location_id, parts[name][0] if name in parts else None)
+        return row_counts
+
+    def remove_parts_before(self, name, location_id, part=None):
+        """remove the parts older than `part`, all of them if None"""
+        if part is None:
+            part = self.next_part(name, location_id)
+        old_parts = self.conn.execute('SELECT part, path FROM parts WHERE format = ? AND location_id = ? AND part < ?',
+                                      (name, location_id, part)).fetchall()
+        for _, path in old_parts:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        with self.conn:
+            self.conn.execute('DELETE FROM parts WHERE format = ? AND location_id = ? AND part < ?',
+                              (name, location_id, part))
+
+    def export_all(self, locations=None, full=False):
+        """:return: {format: number of rows written} over all locations"""
+        storage = get_storage()
+        totals = {name: 0 for name in self.formats}
+        for location in locations or config.locations:
+            try:
+                for name, row_count in self.export(location['id'], storage, full).items():
+                    totals[name] += row_count
+            except Exception as e:
+                logger.error(f'could not bulk export {location["location"]}. error: {e}')
+        return totals
+
+    def close(self):
+        self.conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export the results of all locations as csv, parquet or arrow')
+    parser.add_argument('--format', nargs='+', choices=list(FORMATS), default=BULK_EXPORT_FORMATS)
+    parser.add_argument('--location', help='id of the only location to export')
+    parser.add_argument('--full', action='store_true',
+                        help='write every listing again into one new part and remove the older parts')
+    args = parser.parse_args()
+    metrics.setup()
+
+    locations = [location for location in config.locations
+                 if not args.location or str(location['id']) == args.location]
+    exporter = BulkExporter(args.format)
+    totals = exporter.export_all(locations, args.full)
+    logger.info('bulk export done. ' + ', '.join(f'{name}: {count} rows' for name, count in totals.items()))
+    exporter.close()
+    metrics.save(force=True)
+
+
+if __name__ == '__main__':
+    main()
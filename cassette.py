@@ -0,0 +1,207 @@
+"""
+record the http traffic of a run and replay it later without any network access.
+
+    python search_hemnet.py --record runs/stockholm.cassette
+    python search_hemnet.py --replay runs/stockholm.cassette
+
+responses are stored zlib compressed in one sqlite file, keyed by the method, the normalised url
+(lowercase host, sorted query) and a hash of the request body. headers are not part of the key,
+so changing tokens and timestamps don't matter. in replay mode a request missing from the cassette
+fails with a ConnectionError and the faktakontroll sleeps and hemnet rate limits are skipped.
+
+a run with a cassette never touches the real caches, storage, queues and reports. recording copies
+CACHE_DIR to <cassette>.state, without the lookup and http caches, and both recording and replay
+run on a copy of that state in a scratch directory. the lookups start from empty caches every time,
+so the replay makes the same requests as the recording
+"""
+import os
+import json
+import zlib
+import atexit
+import shutil
+import sqlite3
+import hashlib
+import datetime
+import tempfile
+import threading
+import config
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from requests import ConnectionError
+from http_client import TimedAdapter, build_response
+
+logger = config.logger
+
+RECORD = 'record'
+REPLAY = 'replay'
+# files of CACHE_DIR left out of the recorded state
+UNRECORDED_FILES = {'lookup-cache.db', 'http-cache.db'}
+
+
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path or '/', query, ''))
+
+
+def request_key(method, url, body):
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+    body_hash = hashlib.sha1(body or b'').hexdigest()
+    return hashlib.sha1(f'{method.upper()} {normalize_url(url)} {body_hash}'.encode()).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path, mode):
+        if mode == REPLAY and not os.path.exists(path):
+            raise FileNotFoundError(f'cassette not found: {path}')
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.missing = 0
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS interactions (
+                    key TEXT PRIMARY KEY,
+                    method TEXT NOT NULL,
+                    url TEXT NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    recorded_at TEXT NOT NULL
+                )
+            ''')
+
+    def save(self, request, response):
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() in ('content-type', 'etag', 'last-modified', 'location')}
+        with self.lock, self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO interactions VALUES (?, ?, ?, ?, ?, ?, ?)', (
+                request_key(request.method, request.url, request.body),
+                request.method,
+                normalize_url(request.url),
+                response.status_code,
+                json.dumps(headers),
+                zlib.compress(response.content),
+                datetime.datetime.now().isoformat(timespec='seconds'),
+            ))
+            self.recorded += 1
+
+    def load(self, request):
+        """:return: (status, headers, body) or None"""
+        key = request_key(request.method, request.url, request.body)
+        with self.lock:
+            row = self.conn.execute('SELECT status, headers, body FROM interactions WHERE key = ?',
+                                    (key,)).fetchone()
+            if row is None:
+                self.missing += 1
+                return None
+            self.replayed += 1
+        return row[0], json.loads(row[1]), zlib.decompress(row[2])
+
+    def summary(self):
+        return f'cassette {self.path} ({self.mode}): {self.recorded} recorded, ' \
+               f'{self.replayed} replayed, {self.missing} missing'
+
+
+class CassetteAdapter(TimedAdapter):
+    def __init__(self, cassette, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cassette = cassette
+
+    def send(self, request, **kwargs):
+        if self.cassette.mode == REPLAY:
+            recorded = self.cassette.load(request)
+            if recorded is None:
+                raise ConnectionError(f'{request.method} {request.url} is not in the cassette', request=request)
+            return build_response(request, *recorded)
+
+        response = super().send(request, **kwargs)
+        self.cassette.save(request, response)
+        return response
+
+
+_cassette = None
+
+
+def copy_state(source_dir, target_dir):
+    """copy the files of a cache dir, the sqlite databases with their wal applied"""
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.makedirs(target_dir)
+    for name in os.listdir(source_dir) if os.path.isdir(source_dir) else []:
+        source = os.path.join(source_dir, name)
+        if name in UNRECORDED_FILES or name.endswith(('-wal', '-shm')) or not os.path.isfile(source):
+            continue
+        if name.endswith('.db'):
+            with sqlite3.connect(source, timeout=30) as source_conn, \
+                    sqlite3.connect(os.path.join(target_dir, name)) as target_conn:
+                source_conn.backup(target_conn)
+            source_conn.close()
+            target_conn.close()
+        else:
+            shutil.copy2(source, target_dir)
+
+
+def isolate(mode, path):
+    """
+    point CACHE_DIR and DOC_DIR at a scratch directory with the state of the cassette. the paths
+    of the caches, indexes and reports are made from them when those are opened, so this has to
+    run before any of them is created
+    """
+    state_dir = f'{path}.state'
+    if mode == RECORD:
+        copy_state(config.CACHE_DIR, state_dir)
+    elif not os.path.isdir(state_dir):
+        logger.warning(f'no state recorded with {path}. replaying with empty caches')
+    scratch_dir = tempfile.mkdtemp(prefix='cassette-')
+    cache_dir = os.path.join(scratch_dir, 'cache')
+    copy_state(state_dir, cache_dir)
+    config.CACHE_DIR = cache_dir
+    config.DOC_DIR = os.path.join(scratch_dir, 'docs')
+    os.makedirs(config.DOC_DIR)
+    for name in ('metrics_dir', 'bulk_export_dir'):
+        if hasattr(config, name):
+            setattr(config, name, os.path.join(scratch_dir, name))
+    atexit.register(shutil.rmtree, scratch_dir, True)
+    logger.info(f'cassette run in scratch directory: {scratch_dir}')
+
+
+def use(mode, path):
+    """
+    record or replay all the http traffic of this process, in a scratch copy of the cache dir.
+    call it at the start of a script, before anything is read from the cache dir
+    """
+    global _cassette
+    _cassette = Cassette(path, mode)
+    isolate(mode, path)
+    logger.info(f'{mode}ing http traffic: {path}')
+
+
+def get_cassette():
+    return _cassette
+
+
+def replaying():
+    return _cassette is not None and _cassette.mode == REPLAY
+
+
+def log_stats():
+    if _cassette is not None:
+        logger.info(_cassette.summary())
+
+
+def add_arguments(parser):
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument('--record', metavar='CASSETTE', help='record the http traffic of this run')
+    group.add_argument('--replay', metavar='CASSETTE', help='replay recorded http traffic, no network is used')
+
+
+def use_arguments(args):
+    if args.record:
+        use(RECORD, args.record)
+    elif args.replay:
+        use(REPLAY, args.replay)
+
@@ -0,0 +1,75 @@
+import os
+import json
+import config
+from atomic_io import file_lock, atomic_write_json
+
+logger = config.logger
+
+CRAWL_STATE_NAME = 'crawl-state.json'
+
+# stop paginating once the pages only contain listings we already know about
+INCREMENTAL_CRAWL = getattr(config, 'incremental_crawl', True)
+# number of extra pages of known listings to read before stopping, in case listings
+# were moved around between two runs
+CRAWL_OVERLAP_PAGES = getattr(config, 'crawl_overlap_pages', 1)
+
+
+def crawl_state_file():
+    return os.path.join(config.CACHE_DIR, CRAWL_STATE_NAME)
+
+
+def load_crawl_state():
+    try:
+        with open(crawl_state_file()) as f:
+            return json.load(f)
+    except:
+        return {}
+
+
+def get_newest(location_id, kind):
+    """newest listing (or sold listing link) seen on the last crawl of this location"""
+    return load_crawl_state().get(str(location_id), {}).get(kind)
+
+
+def set_newest(location_id, kind, value):
+    if value is None:
+        return
+    try:
+        with file_lock(crawl_state_file()):
+            state = load_crawl_state()
+            state.setdefault(str(location_id), {})[kind] = value
+            atomic_write_json(crawl_state_file(), state)
+    except Exception as e:
+        logger.error(f'could not save crawl state. error: {e}')
+
+
+class EarlyStop:
+    """
+    decides when an incremental crawl over pages sorted newest first can stop.
+    a page is stale when all of its listings are known, so a listing that could not be read on an
+    earlier run is tried again wherever it is. the crawl stops after `overlap` stale pages in a row.
+    the newest listing of the last crawl is only a hint: on its page the listings above it are newer
+    ones read by this run, only the listings from it on have to be known
+    """
+
+    def __init__(self, newest=None, overlap=CRAWL_OVERLAP_PAGES, enabled=INCREMENTAL_CRAWL):
+        self.newest = newest
+        self.overlap = overlap
+        self.enabled = enabled
+        self.stale_pages = 0
+
+    def page_done(self, page_ids, known):
+        """
+        :param page_ids: ids of the listings on the page, in page order
+        :param known: function that returns True if an id is already known
+        :return: True if no more pages need to be read
+        """
+        if not self.enabled or not page_ids:
+            return False
+        if self.newest is not None and self.newest in page_ids:
+            page_ids = page_ids[page_ids.index(self.newest):]
+        if all(known(page_id) for page_id in page_ids):
+            self.stale_pages += 1
+        else:
+            self.stale_pages = 0
+        return self.stale_pages > self.overlap
@@ -0,0 +1,189 @@
+"""
+runs the hemnet search, the sold properties search and the faktakontroll loop as jobs of one process,
+and the bulk export if `daemon_bulk_export_interval` is set.
+
+    python daemon.py
+
+sessions, caches and the faktakontroll token are kept between runs. every job has its own
+rate limit for hemnet and sleeps exactly until its next run is due.
+
+the jobs run one after the other in this thread, they share the sqlite connections of the caches
+and indexes. while a job runs the others wait: a faktakontroll step sleeps between its searches
+and while the token is refreshed or rate limited, so a hemnet job that is due starts late by up
+to the length of one step. a job starting more than `daemon_late_warning` seconds late is logged
+run times of the jobs are logged and written to daemon-stats.json, metrics to <metrics_dir>/daemon.prom
+"""
+import os
+import time
+import heapq
+import config
+import argparse
+import cassette
+import metrics
+import search_hemnet
+import search_hemnet_sold
+import search_faktakontroll
+from bulk_export import BulkExporter
+from utils import Hemnet
+from fetcher import ConcurrentFetcher, RateLimiter
+from work_queue import PendingQueue
+from atomic_io import atomic_write_json
+
+logger = config.logger
+
+DAEMON_STATS_NAME = 'daemon-stats.json'
+# seconds between two runs of the hemnet jobs
+SEARCH_INTERVAL = getattr(config, 'daemon_search_interval', 30 * 60)
+SOLD_INTERVAL = getattr(config, 'daemon_sold_interval', 60 * 60)
+# seconds between two bulk exports. no bulk export if not set
+BULK_EXPORT_INTERVAL = getattr(config, 'daemon_bulk_export_interval', None)
+# seconds between two writes of daemon-stats.json
+STATS_INTERVAL = getattr(config, 'daemon_stats_interval', 60)
+# requests per second allowed on hemnet for each job
+SEARCH_RATE = getattr(config, 'daemon_search_rate', 2)
+SOLD_RATE = getattr(config, 'daemon_sold_rate', 1)
+# a job starting this many seconds after it was due is logged
+LATE_WARNING = getattr(config, 'daemon_late_warning', 60)
+
+JOB_SECONDS = metrics.histogram('scraper_job_seconds', 'run time of the daemon jobs', ['job'])
+JOB_FAILURES = metrics.counter('scraper_job_failures_total', 'daemon job runs that raised an error', ['job'])
+
+
+class Job:
+    def __init__(self, name, func, interval):
+        """
+        :param func: runs the job once. may return the number of seconds until the next run,
+            otherwise `interval` is used
+        """
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.next_run = time.monotonic()
+        self.runs = 0
+        self.failures = 0
+        self.total_time = 0
+        self.last_time = 0
+        self.max_time = 0
+
+    def run(self):
+        started_at = time.monotonic()
+        wait = None
+        try:
+            wait = self.func()
+        except Exception as e:
+            self.failures += 1
+            JOB_FAILURES.inc(job=self.name)
+            logger.critical(f'job {self.name} failed. error: {e}')
+        duration = time.monotonic() - started_at
+        JOB_SECONDS.observe(duration, job=self.name)
+        self.runs += 1
+        self.total_time += duration
+        self.last_time = duration
+        self.max_time = max(self.max_time, duration)
+        self.next_run = time.monotonic() + (self.interval if wait is None else wait)
+
+    def stats(self):
+        return {
+            'runs': self.runs,
+            'failures': self.failures,
+            'last_seconds': round(self.last_time, 3),
+            'average_seconds': round(self.total_time / self.runs, 3) if self.runs else 0,
+            'max_seconds': round(self.max_time, 3),
+            'total_seconds': round(self.total_time, 3),
+        }
+
+
+class Scheduler:
+    def __init__(self):
+        self.jobs = []
+        self.stats_saved_at = time.monotonic()
+
+    def add(self, job):
+        self.jobs.append(job)
+
+    def save_stats(self):
+        self.stats_saved_at = time.monotonic()
+        stats = {job.name: job.stats() for job in self.jobs}
+        try:
+            atomic_write_json(os.path.join(config.CACHE_DIR, DAEMON_STATS_NAME), stats, indent=2)
+        except Exception as e:
+            logger.error(f'could not save daemon stats. error: {e}')
+
+    def run_forever(self):
+        # (next run, position, job). the position keeps the order stable for jobs due at the same time
+        heap = [(job.next_run, i, job) for i, job in enumerate(self.jobs)]
+        heapq.heapify(heap)
+        while True:
+            next_run, i, job = heapq.heappop(heap)
+            wait = next_run - time.monotonic()
+            if wait > 0:
+                with metrics.sleeping('idle'):
+                    time.sleep(wait)
+            elif -wait > LATE_WARNING:
+                # the job before it took longer than the time left until this one was due
+                logger.info(f'job {job.name} started {-wait:.0f}s late')
+            job.run()
+            metrics.save()
+            if job.last_time > 1:
+                logger.info(f'job {job.name} took {job.last_time:.1f}s. next run in '
+                            f'{job.next_run - time.monotonic():.0f}s')
+            if time.monotonic() - self.stats_saved_at >= STATS_INTERVAL:
+                self.save_stats()
+            heapq.heappush(heap, (job.next_run, i, job))
+
+
+class HemnetJobs:
+    """
+    keeps the sessions and the fetch thread pool of every job open between its runs. the results
+    of a location are loaded for a run and dropped after it, other jobs change them in the meantime
+    """
+
+    def __init__(self):
+        self.queue = PendingQueue()
+        self.search_rate_limiter = RateLimiter(SEARCH_RATE)
+        self.sold_rate_limiter = RateLimiter(SOLD_RATE)
+        self.connections = {}
+
+    def get_hemnet(self, kind, location, rate_limiter, load_results=True):
+        if kind not in self.connections:
+            self.connections[kind] = (Hemnet.new_session(),
+                                      ConcurrentFetcher(Hemnet.new_session, rate_limiter=rate_limiter))
+        session, fetcher = self.connections[kind]
+        return Hemnet(location, rate_limiter, session, fetcher, load_results)
+
+    def search(self):
+        location = search_hemnet.get_location()
+        search_hemnet.run(self.get_hemnet('search', location, self.search_rate_limiter), self.queue)
+
+    def search_sold(self):
+        location = search_hemnet_sold.get_location()
+        search_hemnet_sold.run(self.get_hemnet('sold', location, self.sold_rate_limiter, load_results=False))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    cassette.add_arguments(parser)
+    cassette.use_arguments(parser.parse_args())
+    metrics.setup('daemon')
+
+    os.makedirs(config.CACHE_DIR, exist_ok=True)
+    hemnet_jobs = HemnetJobs()
+    worker = search_faktakontroll.Worker()
+
+    scheduler = Scheduler()
+    scheduler.add(Job('hemnet', hemnet_jobs.search, SEARCH_INTERVAL))
+    scheduler.add(Job('hemnet_sold', hemnet_jobs.search_sold, SOLD_INTERVAL))
+    scheduler.add(Job('faktakontroll', worker.step, 0))
+    if BULK_EXPORT_INTERVAL:
+        bulk_exporter = BulkExporter()
+
+        def bulk_export():
+            # export_all returns the rows written, not a wait like the other jobs
+            bulk_exporter.export_all()
+
+        scheduler.add(Job('bulk_export', bulk_export, BULK_EXPORT_INTERVAL))
+    scheduler.run_forever()
+
+
+if __name__ == '__main__':
+    main()
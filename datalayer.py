@@ -0,0 +1,95 @@
+"""
+read the `dataLayer = [...]` assignment of hemnet listing pages.
+
+the page is searched as bytes for the first assignment and only the json array is decoded,
+the rest of the page is never turned into text
+"""
+import re
+import json
+from dataclasses import dataclass
+
+DATALAYER_START = re.compile(rb'\bdataLayer\s*=\s*\[')
+# the array is decoded from a slice of the page. the slice is doubled until the array fits in it
+CHUNK_SIZE = 16 * 1024
+
+_decoder = json.JSONDecoder()
+
+
+@dataclass
+class PropertyRecord:
+    id: str
+    location: str = None
+    street_address: str = None
+    living_area: float = None
+    housing_form: str = None
+    supplemental_area: float = None
+    publication_date: str = None
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            id=str(data.get('id')),
+            location=data.get('location'),
+            street_address=data.get('street_address'),
+            living_area=data.get('living_area'),
+            housing_form=data.get('housing_form'),
+            supplemental_area=data.get('supplemental_area'),
+            publication_date=data.get('publication_date'),
+        )
+
+
+@dataclass
+class SoldPropertyRecord:
+    property_id: str
+    sold_at_date: str = None
+
+
+def extract_datalayer(content):
+    """
+    :param content: page as bytes (or str)
+    :return: the list assigned to the first dataLayer on the page, None if not found
+    """
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    match = DATALAYER_START.search(content)
+    if not match:
+        return None
+    start = match.end() - 1
+    size = CHUNK_SIZE
+    while True:
+        chunk = content[start:start + size]
+        try:
+            datalayer, _ = _decoder.raw_decode(chunk.decode('utf-8', 'ignore'))
+            return datalayer
+        except json.JSONDecodeError:
+            if start + size >= len(content):
+                return None
+            size *= 2
+
+
+def find_property(datalayer):
+    for dl in datalayer or []:
+        if isinstance(dl, dict) and dl.get('property'):
+            return dl['property']
+    return None
+
+
+def parse_property(content):
+    """:return: PropertyRecord of a listing page, None if the page has no property"""
+    _property = find_property(extract_datalayer(content))
+    return PropertyRecord.from_dict(_property) if _property else None
+
+
+def parse_sold_property(content):
+    """:return: SoldPropertyRecord of a sold listing page, None if the page has no property"""
+    prop_id = None
+    sold_date = 'date not found'
+    for dl in extract_datalayer(content) or []:
+        try:
+            if 'property' in dl.keys():
+                prop_id = str(dl['property']['id'])
+            if 'sold_property' in dl.keys():
+                sold_date = dl['sold_property']['sold_at_date']
+        except:
+            pass
+    return SoldPropertyRecord(prop_id, sold_date) if prop_id else None
@@ -0,0 +1,221 @@
+"""
+excel reports of the matched results, one <location name>.xlsx per location.
+
+rows are streamed into a write-only workbook and a report is only written again when the
+results it is made from have changed. run this file to regenerate the reports of all locations:
+
+    python export.py [--force]
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import config
+import metrics
+import profiling
+import openpyxl
+from openpyxl.utils import get_column_letter
+from storage import get_storage
+from records import plain
+from atomic_io import atomic_write, atomic_write_json
+
+logger = config.logger
+
+EXPORT_STATE_NAME = 'export-state.json'
+# minimum number of seconds between two exports of the same location. the reports are written
+# again whenever the faktakontroll loop runs out of work and before it stops, so nothing is lost
+EXPORT_DEBOUNCE_SECONDS = getattr(config, 'export_debounce_seconds', 5 * 60)
+
+EXPORT_SECONDS = metrics.histogram('scraper_export_seconds', 'time spent writing reports')
+EXPORTS = metrics.counter('scraper_exports_total', 'report exports by result', ['result'])
+
+HEADERS = ['Id', 'Tot Hits', 'Tot Apartments', 'Address', 'City', 'Bostadstyp', 'Area', 'Extra Area',
+           'Floor', 'Name', 'Kön', 'Personnr', 'Ålder'] + [
+              'Phone 1', 'Phone 2', 'Phone 3', 'Phone 4', 'Phone 5', 'Phone 6',
+          ] + ['Apartment', 'Area Match Type', 'Publish Date', 'Sold']
+
+
+def get_phone_columns(phone_numbers):
+    if len(phone_numbers) > 6:
+        phone_numbers = phone_numbers[:6]
+    elif len(phone_numbers) < 6:
+        phone_numbers = phone_numbers + [''] * (6 - len(phone_numbers))
+    return phone_numbers
+
+
+def entry_rows(match_id, entry):
+    """rows of one result. empty if it has no matches or too many of them"""
+    if not entry['complete'] or not entry['matches']:
+        return []
+
+    try:
+        address = entry.get('street_address') or ''
+        city = entry.get('city') or ''
+        house_type = entry.get('house_type') or ''
+        area = entry.get('area') or ''
+        extra_area = entry.get('extra_area') or ''
+        floor = entry.get('floor') or ''
+        total_matches = len(entry['matches'])
+        apartments = []
+        sold = entry.get('sold_date') or ''
+        row_template = [match_id, total_matches, 1, address, city, house_type, area, extra_area, floor]
+
+        new_rows = []
+        for match in entry['matches']:
+            new_row = row_template.copy()
+            apartment = match.get('apartment') or ''
+            if apartment and apartment in apartments:
+                pass
+            else:
+                apartments.append(apartment)
+            new_row += [match['name'], match.get('gender') or '', match['person_number'],
+                        match.get('age') or '',
+                        ] + get_phone_columns(match['numbers']) + [
+                           f'lgh {apartment}' if apartment else '',
+                           'Full' if match['full_match'] else 'Partial',
+                           entry.get('publication_date'),
+                           sold
+                       ]
+            new_rows.append(new_row)
+
+        # check if apartment is empty then number of apartments would be 1
+        for row in new_rows:
+            if row[len(row_template) + 10].strip() == '':
+                row[2] = 1
+            else:
+                row[2] = len(apartments)
+
+        if len(new_rows) <= config.max_results:
+            return new_rows
+    except Exception:
+        pass
+    return []
+
+
+def iter_rows(results):
+    for match_id, entry in results.items():
+        yield from entry_rows(match_id, entry)
+
+
+def fingerprint(results):
+    """changes whenever something shown in the report of these results changes"""
+    digest = hashlib.sha1()
+    for match_id, entry in results.items():
+        if entry.get('complete') and entry.get('matches'):
+            digest.update(json.dumps([match_id, entry], sort_keys=True, default=plain).encode())
+    return digest.hexdigest()
+
+
+def report_path(location):
+    return os.path.join(config.DOC_DIR, f'{location["location"]}.xlsx')
+
+
+@profiling.stage('export')
+@EXPORT_SECONDS.time()
+def write_xlsx(filename, rows):
+    # write only workbooks stream the rows to disk instead of keeping every cell in memory
+    wb = openpyxl.Workbook(write_only=True)
+    sheet = wb.create_sheet()
+
+    # freeze the header
+    sheet.freeze_panes = 'A2'
+
+    sheet.append(HEADERS)
+    row_count = 1
+    for row in rows:
+        sheet.append(row)
+        row_count += 1
+
+    # add filters to all columns
+    sheet.auto_filter.ref = f'A1:{get_column_letter(len(HEADERS))}{row_count}'
+
+    # the file is replaced in one step, so a report being written is never opened half done
+    try:
+        with atomic_write(filename, 'wb') as f:
+            wb.save(f)
+        logger.info(f'data saved as "{filename}"')
+        return True
+    except Exception as e:
+        logger.error(f'could not save "{filename}". error: {e}')
+        return False
+
+
+class Exporter:
+    """
+    writes the report of a location when its results changed since the last export.
+    locations can be marked dirty and exported later with `flush`, at most once every `debounce` seconds
+    """
+
+    def __init__(self, debounce=EXPORT_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self.dirty = {}
+        self.last_export = {}
+        self.state = self.load_state()
+
+    @staticmethod
+    def load_state():
+        try:
+            with open(os.path.join(config.CACHE_DIR, EXPORT_STATE_NAME)) as f:
+                return json.load(f)
+        except:
+            return {}
+
+    def save_state(self):
+        try:
+            atomic_write_json(os.path.join(config.CACHE_DIR, EXPORT_STATE_NAME), self.state)
+        except Exception as e:
+            logger.error(f'could not save export state. error: {e}')
+
+    def export(self, location, results=None, force=False):
+        """:return: True if the report was written"""
+        if results is None:
+            results = get_storage().load(location['id'])
+        filename = report_path(location)
+        new_fingerprint = fingerprint(results)
+        if not force and self.state.get(str(location['id'])) == new_fingerprint and os.path.exists(filename):
+            logger.debug(f'report of {location["location"]} is up to date')
+            EXPORTS.inc(result='unchanged')
+            return False
+
+        logger.info('saving data in excel file...')
+        if not write_xlsx(filename, iter_rows(results)):
+            EXPORTS.inc(result='failed')
+            return False
+        EXPORTS.inc(result='written')
+        self.state[str(location['id'])] = new_fingerprint
+        self.save_state()
+        self.last_export[str(location['id'])] = time.monotonic()
+        return True
+
+    def mark_dirty(self, location):
+        self.dirty[str(location['id'])] = location
+
+    def flush(self, force=False):
+        """export the dirty locations whose last export is older than the debounce interval"""
+        now = time.monotonic()
+        for location_id, location in list(self.dirty.items()):
+            last_export = self.last_export.get(location_id)
+            if not force and last_export is not None and now - last_export < self.debounce:
+                continue
+            del self.dirty[location_id]
+            # an unchanged report is not written but still counts, checking it loads the whole cache
+            self.last_export[location_id] = now
+            try:
+                self.export(location)
+            except Exception as e:
+                logger.error(f'could not export {location["location"]}. error: {e}')
+
+
+def main():
+    force = '--force' in sys.argv[1:]
+    exporter = Exporter()
+    for location in config.locations:
+        try:
+            exporter.export(location, force=force)
+        except Exception as e:
+            logger.error(f'could not export {location["location"]}. error: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+extract the listing links from hemnet result pages.
+
+three backends are available, selected with `config.html_extractor`:
+    scan - regular expressions over the raw response bytes. no html tree is built
+    lxml - lxml's html parser (needs lxml installed)
+    bs4  - BeautifulSoup's html.parser, the slowest one. used as fallback
+"""
+import re
+import json
+import html
+import config
+from bs4 import BeautifulSoup
+
+logger = config.logger
+
+HTML_EXTRACTOR = getattr(config, 'html_extractor', 'scan')
+
+LISTING_CLASSES = ('normal-results__hit', 'js-normal-list-item')
+SOLD_CLASS = 'sold-property-listing'
+
+
+class Bs4Extractor:
+    name = 'bs4'
+
+    @staticmethod
+    def listing_hits(content):
+        hits = []
+        soup = BeautifulSoup(content, 'html.parser')
+        # list all the search results in current page
+        lis = soup.find_all('li', {'class': ' '.join(LISTING_CLASSES)})
+        for li in lis:
+            try:
+                hits.append({
+                    'url': li.find('a')['href'],
+                    'id': json.loads(li['data-gtm-item-info'])['id']
+                })
+            except Exception as e:
+                logger.error(f'could not get link. error: {e}')
+        return hits
+
+    @staticmethod
+    def sold_links(content):
+        soup = BeautifulSoup(content, 'html.parser')
+        return [link['href'] for link in soup.find_all('a', {'class': SOLD_CLASS}) if link.get('href')]
+
+
+class LxmlExtractor:
+    name = 'lxml'
+    LISTING_XPATH = '//li[' + ' and '.join(
+        f'contains(concat(" ", normalize-space(@class), " "), " {cls} ")' for cls in LISTING_CLASSES) + ']'
+    SOLD_XPATH = f'//a[contains(concat(" ", normalize-space(@class), " "), " {SOLD_CLASS} ")]/@href'
+
+    def __init__(self):
+        from lxml import html as lxml_html
+        self.lxml_html = lxml_html
+
+    def listing_hits(self, content):
+        hits = []
+        tree = self.lxml_html.fromstring(content)
+        for li in tree.xpath(self.LISTING_XPATH):
+            try:
+                hits.append({
+                    'url': li.xpath('.//a/@href')[0],
+                    'id': json.loads(li.get('data-gtm-item-info'))['id']
+                })
+            except Exception as e:
+                logger.error(f'could not get link. error: {e}')
+        return hits
+
+    def sold_links(self, content):
+        return [str(href) for href in self.lxml_html.fromstring(content).xpath(self.SOLD_XPATH)]
+
+
+class ScanExtractor:
+    """
+    looks only at the opening tags of the elements we need. works on bytes so the page
+    is never decoded as a whole
+    """
+    name = 'scan'
+    LI_TAG = re.compile(rb'<li\b[^>]*>', re.IGNORECASE)
+    A_TAG = re.compile(rb'<a\b[^>]*>', re.IGNORECASE)
+    CLASS_ATTR = re.compile(rb'\sclass\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+    HREF_ATTR = re.compile(rb'\shref\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+    GTM_ATTR = re.compile(rb'\sdata-gtm-item-info\s*=\s*(?:"([^"]*)"|\'([^\']*)\')', re.IGNORECASE)
+
+    @staticmethod
+    def attr(pattern, tag):
+        match = pattern.search(tag)
+        if not match:
+            return None
+        value = match.group(1) if match.group(1) is not None else match.group(2)
+        return html.unescape(value.decode('utf-8', 'replace'))
+
+    @classmethod
+    def has_classes(cls, tag, classes):
+        class_value = cls.attr(cls.CLASS_ATTR, tag)
+        if class_value is None:
+            return False
+        tokens = class_value.split()
+        return all(c in tokens for c in classes)
+
+    @classmethod
+    def listing_hits(cls, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        hits = []
+        for li_match in cls.LI_TAG.finditer(content):
+            li_tag = li_match.group(0)
+            if b'normal-results__hit' not in li_tag or not cls.has_classes(li_tag, LISTING_CLASSES):
+                continue
+            try:
+                a_match = cls.A_TAG.search(content, li_match.end())
+                hits.append({
+                    'url': cls.attr(cls.HREF_ATTR, a_match.group(0)),
+                    'id': json.loads(cls.attr(cls.GTM_ATTR, li_tag))['id']
+                })
+            except Exception as e:
+                logger.error(f'could not get link. error: {e}')
+        return hits
+
+    @classmethod
+    def sold_links(cls, content):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        links = []
+        for a_match in cls.A_TAG.finditer(content):
+            a_tag = a_match.group(0)
+            if SOLD_CLASS.encode() not in a_tag or not cls.has_classes(a_tag, (SOLD_CLASS,)):
+                continue
+            href = cls.attr(cls.HREF_ATTR, a_tag)
+            if href:
+                links.append(href)
+        return links
+
+
+BACKENDS = {
+    'scan': ScanExtractor,
+    'lxml': LxmlExtractor,
+    'bs4': Bs4Extractor,
+}
+
+_extractors = {}
+
+
+def get_extractor(name=HTML_EXTRACTOR):
+    """the requested extractor. falls back to bs4 if it can not be used here"""
+    if name not in _extractors:
+        try:
+            _extractors[name] = BACKENDS[name]()
+        except Exception as e:
+            logger.warning(f'html extractor "{name}" not available, using bs4. error: {e}')
+            _extractors[name] = Bs4Extractor()
+    return _extractors[name]
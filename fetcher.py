@@ -0,0 +1,139 @@
+import time
+import threading
+import config
+import cassette
+import metrics
+from http_client import record_failure
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+
+logger = config.logger
+
+# number of requests that can be in flight at the same time
+FETCH_CONCURRENCY = getattr(config, 'fetch_concurrency', 1)
+# requests per second allowed for each host. None means no limit
+FETCH_RATE_PER_HOST = getattr(config, 'fetch_rate_per_host', None)
+# number of requests that can be sent in a burst before the rate limit kicks in
+FETCH_BURST = getattr(config, 'fetch_burst', 1)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = max(capacity, 1)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """block until a token is available and take it"""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            with metrics.sleeping('rate_limit'):
+                time.sleep(wait)
+
+
+class RateLimiter:
+    """one token bucket per host"""
+
+    def __init__(self, rate=FETCH_RATE_PER_HOST, burst=FETCH_BURST):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, url):
+        # recorded responses are not rate limited
+        if not self.rate or cassette.replaying():
+            return
+        host = urlsplit(url).netloc
+        with self.lock:
+            bucket = self.buckets.get(host)
+            if bucket is None:
+                bucket = self.buckets[host] = TokenBucket(self.rate, self.burst)
+        bucket.acquire()
+
+
+class ConcurrentFetcher:
+    """
+    fetches urls on a thread pool. every worker thread gets its own session from `session_factory`
+    and all of them share the same per host rate limit. responses are returned in the order of the requests.
+
+    the pool lives as long as the fetcher, so its threads keep their sessions and connections
+    from one batch to the next. `close` stops the threads and closes the sessions
+    """
+
+    def __init__(self, session_factory, concurrency=FETCH_CONCURRENCY, rate_limiter=None):
+        self.session_factory = session_factory
+        self.concurrency = max(concurrency, 1)
+        self.rate_limiter = rate_limiter or RateLimiter()
+        self.local = threading.local()
+        self.executor = None
+        self.sessions = []
+        self.request_count = 0
+        self.error_count = 0
+        self.bytes_received = 0
+        self.time_spent = 0
+        self.stats_lock = threading.Lock()
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+        if session is None:
+            session = self.local.session = self.session_factory()
+            with self.stats_lock:
+                self.sessions.append(session)
+        return session
+
+    def get(self, url, params=None):
+        self.rate_limiter.acquire(url)
+        try:
+            response = self.session.get(url, params=params)
+        except Exception as e:
+            record_failure(url)
+            with self.stats_lock:
+                self.request_count += 1
+                self.error_count += 1
+            return e
+        with self.stats_lock:
+            self.request_count += 1
+            self.bytes_received += len(response.content)
+        return response
+
+    def get_all(self, urls, params_list=None):
+        """
+        :return: list of responses in the same order as `urls`. failed requests are returned as the exception
+        """
+        params_list = params_list or [None] * len(urls)
+        started_at = time.monotonic()
+        if self.concurrency == 1 or len(urls) <= 1:
+            responses = [self.get(url, params) for url, params in zip(urls, params_list)]
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='fetch')
+            responses = list(self.executor.map(self.get, urls, params_list))
+        with self.stats_lock:
+            self.time_spent += time.monotonic() - started_at
+        return responses
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        for session in self.sessions:
+            session.close()
+        self.sessions = []
+        self.local = threading.local()
+
+    def summary(self):
+        rate = self.request_count / self.time_spent if self.time_spent else 0
+        return f'{self.request_count} requests ({self.error_count} failed), ' \
+               f'{self.bytes_received / 1024:.0f} kB in {self.time_spent:.1f}s. ' \
+               f'{rate:.2f} requests/s with concurrency {self.concurrency}'
@@ -0,0 +1,170 @@
+"""
+on-disk cache of hemnet responses.
+
+fresh responses are served without any request. stale ones are revalidated with
+If-None-Match / If-Modified-Since and served from the cache when hemnet answers 304.
+how long a response stays fresh depends on the kind of page, see HTTP_CACHE_TTLS
+"""
+import os
+import re
+import json
+import time
+import zlib
+import sqlite3
+import threading
+import config
+from metrics import CACHE_REQUESTS
+from http_client import TimedAdapter, build_response
+
+logger = config.logger
+
+HTTP_CACHE_ENABLED = getattr(config, 'http_cache', False)
+HTTP_CACHE_DB_NAME = 'http-cache.db'
+HTTP_CACHE_MAX_BYTES = getattr(config, 'http_cache_max_bytes', 500 * 1024 * 1024)
+# (url pattern, seconds a response is used without asking hemnet). the first matching pattern is used.
+# urls not matching any pattern are always revalidated
+HTTP_CACHE_TTLS = getattr(config, 'http_cache_ttls', [
+    (r'hemnet\.se/salda/bostader', 0),
+    (r'hemnet\.se/bostader', 0),
+    (r'hemnet\.se/salda/', 365 * 24 * 60 * 60),
+    (r'hemnet\.se/bostad/', 24 * 60 * 60),
+])
+
+
+class HttpCache:
+    def __init__(self, db_file=None, max_bytes=HTTP_CACHE_MAX_BYTES, ttls=HTTP_CACHE_TTLS):
+        db_file = db_file or os.path.join(config.CACHE_DIR, HTTP_CACHE_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.conn = sqlite3.connect(db_file, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    body BLOB NOT NULL,
+                    body_size INTEGER NOT NULL,
+                    stored_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_used_at ON responses (used_at)')
+        self.total_bytes = self.conn.execute('SELECT COALESCE(SUM(LENGTH(body)), 0) FROM responses').fetchone()[0]
+
+    def ttl(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def get(self, url):
+        """:return: (status, headers, body, stored_at) or None"""
+        with self.lock:
+            row = self.conn.execute('SELECT status, headers, body, stored_at FROM responses WHERE url = ?',
+                                    (url,)).fetchone()
+            if row is None:
+                return None
+            with self.conn:
+                self.conn.execute('UPDATE responses SET used_at = ? WHERE url = ?', (time.time(), url))
+        status, headers, body, stored_at = row
+        return status, json.loads(headers), zlib.decompress(body), stored_at
+
+    def set(self, url, status, headers, body):
+        compressed = zlib.compress(body)
+        now = time.time()
+        with self.lock, self.conn:
+            old = self.conn.execute('SELECT LENGTH(body) FROM responses WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, status, json.dumps(dict(headers)), compressed, len(body), now, now))
+            self.total_bytes += len(compressed) - (old[0] if old else 0)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def touch(self, url):
+        """mark a revalidated response as fresh again"""
+        with self.lock, self.conn:
+            self.conn.execute('UPDATE responses SET stored_at = ? WHERE url = ?', (time.time(), url))
+
+    def evict(self):
+        # remove the least recently used responses until the cache is 10% below its limit
+        target = self.max_bytes * 0.9
+        rows = self.conn.execute('SELECT url, LENGTH(body) FROM responses ORDER BY used_at')
+        urls = []
+        for url, size in rows:
+            if self.total_bytes <= target:
+                break
+            urls.append((url,))
+            self.total_bytes -= size
+        self.conn.executemany('DELETE FROM responses WHERE url = ?', urls)
+
+    def count(self, counter, body_size=0):
+        with self.lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+            self.bytes_saved += body_size
+        CACHE_REQUESTS.inc(cache='http', result=counter)
+
+    def summary(self):
+        requests_count = self.hits + self.revalidated + self.misses
+        ratio = (self.hits + self.revalidated) / requests_count * 100 if requests_count else 0
+        return f'http cache: {self.hits} fresh hits, {self.revalidated} revalidated, {self.misses} misses ' \
+               f'({ratio:.0f}% hit ratio). {self.bytes_saved / 1024:.0f} kB not downloaded'
+
+
+class CachingAdapter(TimedAdapter):
+    def __init__(self, cache, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+
+    def send(self, request, **kwargs):
+        if request.method != 'GET':
+            return super().send(request, **kwargs)
+
+        url = request.url
+        cached = self.cache.get(url)
+        if cached:
+            status, headers, body, stored_at = cached
+            if time.time() - stored_at < self.cache.ttl(url):
+                self.cache.count('hits', len(body))
+                return build_response(request, status, headers, body)
+            if headers.get('ETag'):
+                request.headers['If-None-Match'] = headers['ETag']
+            if headers.get('Last-Modified'):
+                request.headers['If-Modified-Since'] = headers['Last-Modified']
+
+        response = super().send(request, **kwargs)
+
+        if cached and response.status_code == 304:
+            self.cache.count('revalidated', len(cached[2]))
+            self.cache.touch(url)
+            return build_response(request, cached[0], cached[1], cached[2])
+
+        self.cache.count('misses')
+        if response.status_code == 200:
+            headers = {name: response.headers[name] for name in ('Content-Type', 'ETag', 'Last-Modified')
+                       if name in response.headers}
+            self.cache.set(url, response.status_code, headers, response.content)
+        return response
+
+
+_http_cache = None
+
+
+def get_http_cache():
+    """the shared cache if enabled with `config.http_cache`, otherwise None"""
+    global _http_cache
+    if HTTP_CACHE_ENABLED and _http_cache is None:
+        _http_cache = HttpCache()
+    return _http_cache
+
+
+def log_stats():
+    if _http_cache is not None:
+        logger.info(_http_cache.summary())
@@ -0,0 +1,151 @@
+"""
+pooled requests sessions that keep their connections alive and record how long
+connecting, the tls handshake and the requests themselves take
+"""
+import re
+import time
+import datetime
+import threading
+import config
+import metrics
+import requests
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlsplit
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+logger = config.logger
+
+# number of connections kept open per host
+HTTP_POOL_SIZE = getattr(config, 'http_pool_size', 10)
+
+HTTP_REQUESTS = metrics.counter('scraper_http_requests_total', 'http requests by endpoint and status',
+                                ['host', 'endpoint', 'status'])
+HTTP_REQUEST_SECONDS = metrics.histogram('scraper_http_request_seconds',
+                                         'time until the response headers arrived, by endpoint',
+                                         ['host', 'endpoint'])
+HTTP_PHASE_SECONDS = metrics.histogram('scraper_http_phase_seconds', 'time spent connecting, in the tls handshake '
+                                       'and waiting for responses', ['phase'])
+# path segments after the first one with an id or a slug in it are dropped, so listings don't get a label each
+ENDPOINT_SEGMENT_RE = re.compile(r'^[a-z_]+$')
+
+
+class Timings:
+    """count and total seconds of each measured step"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def add(self, name, seconds):
+        with self.lock:
+            count, total = self.values.get(name, (0, 0.0))
+            self.values[name] = (count + 1, total + seconds)
+        HTTP_PHASE_SECONDS.observe(seconds, phase=name)
+
+    def summary(self):
+        with self.lock:
+            return ', '.join(f'{name}: {count} x {total / count * 1000:.0f}ms'
+                             for name, (count, total) in sorted(self.values.items()))
+
+
+timings = Timings()
+
+
+class TimedHTTPConnection(HTTPConnection):
+    def _new_conn(self):
+        started_at = time.perf_counter()
+        conn = super()._new_conn()
+        timings.add('connect', time.perf_counter() - started_at)
+        return conn
+
+
+class TimedHTTPSConnection(HTTPSConnection):
+    def _new_conn(self):
+        started_at = time.perf_counter()
+        conn = super()._new_conn()
+        self._connect_time = time.perf_counter() - started_at
+        timings.add('connect', self._connect_time)
+        return conn
+
+    def connect(self):
+        self._connect_time = 0
+        started_at = time.perf_counter()
+        super().connect()
+        # everything after the tcp connection is the tls handshake
+        timings.add('tls', time.perf_counter() - started_at - self._connect_time)
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class TimedAdapter(HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
+
+
+def endpoint(path):
+    segments = []
+    for segment in path.split('/')[1:5]:
+        if not ENDPOINT_SEGMENT_RE.match(segment):
+            break
+        segments.append(segment)
+    return '/' + '/'.join(segments)
+
+
+def record_request(response, *args, **kwargs):
+    url = urlsplit(response.url or '')
+    labels = {'host': url.netloc, 'endpoint': endpoint(url.path)}
+    HTTP_REQUESTS.inc(status=response.status_code, **labels)
+    if getattr(response, 'from_store', False):
+        # cached or replayed, nothing was waited for
+        return
+    # time between sending the request and reading the response headers
+    seconds = response.elapsed.total_seconds()
+    timings.add('request', seconds)
+    HTTP_REQUEST_SECONDS.observe(seconds, **labels)
+
+
+def record_failure(url):
+    """count a request that got no response at all"""
+    url = urlsplit(url)
+    HTTP_REQUESTS.inc(host=url.netloc, endpoint=endpoint(url.path), status='error')
+
+
+def build_response(request, status, headers, body):
+    """response for `request` made from stored data instead of the network"""
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response.encoding = get_encoding_from_headers(response.headers)
+    response._content = body
+    response._content_consumed = True
+    response.url = request.url
+    response.request = request
+    response.reason = 'OK' if status < 400 else 'Error'
+    response.elapsed = datetime.timedelta(0)
+    response.from_store = True
+    return response
+
+
+def create_session(headers=None, pool_size=HTTP_POOL_SIZE, adapter=None):
+    session = requests.session()
+    if adapter is None:
+        adapter = TimedAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.hooks['response'].append(record_request)
+    if headers is not None:
+        session.headers = headers
+    return session
@@ -0,0 +1,30 @@
+"""
+one-shot import of the old <location_id>.json caches into the sqlite result store.
+run it once before switching `config.storage_backend` to "sqlite". the json files are left untouched
+"""
+import config
+from storage import JsonStorage, SqliteStorage
+
+logger = config.logger
+
+
+def main():
+    json_storage = JsonStorage()
+    sqlite_storage = SqliteStorage()
+
+    location_ids = json_storage.location_ids()
+    logger.info(f'{len(location_ids)} json caches found in: {config.CACHE_DIR}')
+
+    for location_id in location_ids:
+        try:
+            results = json_storage.load(location_id)
+        except Exception as e:
+            logger.error(f'could not read cache of location {location_id}. error: {e}')
+            continue
+        sqlite_storage.save(location_id, results)
+
+    sqlite_storage.close()
+
+
+if __name__ == '__main__':
+    main()
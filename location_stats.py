@@ -0,0 +1,127 @@
+"""
+yield based choice of the next location to crawl or search.
+
+after every run the number of requests made and the number of useful results found
+(new listings, sold dates, faktakontroll matches) is recorded per location and kind of job.
+a location's priority is its expected yield per request times the hours since its last visit, so
+busy locations are visited more often. locations not visited for `LOCATION_MAX_REVISIT` seconds
+are always taken first, so no location is starved.
+
+it's off by default (`adaptive_locations`). with the made up locations of
+`benchmarks/simulate_locations.py --demo` it finds about 1% more results than round-robin, 2-4%
+when listings can only be found for 12 to 24 hours (--lifetime). the gain depends on how uneven the
+locations are, run the simulation on the recorded stats before turning it on
+"""
+import os
+import time
+import sqlite3
+import config
+
+logger = config.logger
+
+STATS_DB_NAME = 'location-stats.db'
+
+ADAPTIVE_LOCATIONS = getattr(config, 'adaptive_locations', False)
+# a location is visited at least once in this many seconds
+LOCATION_MAX_REVISIT = getattr(config, 'location_max_revisit', 24 * 60 * 60)
+# weight of the latest run in the moving average of the yield
+YIELD_SMOOTHING = getattr(config, 'location_yield_smoothing', 0.3)
+# yield assumed for locations that were never visited and added to every yield,
+# so quiet locations keep a small share
+YIELD_PRIOR = 0.05
+
+
+class LocationStats:
+    def __init__(self, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, STATS_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS location_stats (
+                    kind TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    runs INTEGER NOT NULL DEFAULT 0,
+                    requests INTEGER NOT NULL DEFAULT 0,
+                    found INTEGER NOT NULL DEFAULT 0,
+                    yield REAL NOT NULL DEFAULT 0,
+                    last_run REAL NOT NULL DEFAULT 0,
+                    PRIMARY KEY (kind, location_id)
+                )
+            ''')
+            # every run, used to replay the history with benchmarks/simulate_locations.py
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS location_runs (
+                    kind TEXT NOT NULL,
+                    location_id TEXT NOT NULL,
+                    at REAL NOT NULL,
+                    requests INTEGER NOT NULL,
+                    found INTEGER NOT NULL
+                )
+            ''')
+
+    def record(self, kind, location_id, requests, found):
+        now = time.time()
+        run_yield = found / requests if requests else 0
+        with self.conn:
+            row = self.conn.execute('SELECT yield, runs FROM location_stats WHERE kind = ? AND location_id = ?',
+                                    (kind, str(location_id))).fetchone()
+            if row is None or row[1] == 0:
+                new_yield = run_yield
+            else:
+                new_yield = YIELD_SMOOTHING * run_yield + (1 - YIELD_SMOOTHING) * row[0]
+            self.conn.execute('''
+                INSERT INTO location_stats (kind, location_id, runs, requests, found, yield, last_run)
+                VALUES (?, ?, 1, ?, ?, ?, ?)
+                ON CONFLICT (kind, location_id) DO UPDATE SET
+                    runs = runs + 1,
+                    requests = requests + excluded.requests,
+                    found = found + excluded.found,
+                    yield = excluded.yield,
+                    last_run = excluded.last_run
+            ''', (kind, str(location_id), requests, found, new_yield, now))
+            self.conn.execute('INSERT INTO location_runs VALUES (?, ?, ?, ?, ?)',
+                              (kind, str(location_id), now, requests, found))
+
+    def get(self, kind):
+        """:return: {location_id: (yield, last_run)}"""
+        rows = self.conn.execute('SELECT location_id, yield, last_run FROM location_stats WHERE kind = ?', (kind,))
+        return {location_id: (location_yield, last_run) for location_id, location_yield, last_run in rows}
+
+    def runs(self, kind):
+        return self.conn.execute('SELECT location_id, at, requests, found FROM location_runs '
+                                 'WHERE kind = ? ORDER BY at', (kind,)).fetchall()
+
+
+def priority(location_yield, last_run, now, max_revisit=LOCATION_MAX_REVISIT):
+    if not last_run:
+        return float('inf')
+    elapsed = now - last_run
+    if elapsed >= max_revisit:
+        # starving locations go first, the longest waiting one before the others
+        return 1e9 + elapsed
+    return (location_yield + YIELD_PRIOR) * elapsed / 3600
+
+
+def rank_locations(locations, stats, now=None):
+    """:return: locations ordered from the highest to the lowest priority"""
+    now = now or time.time()
+    return sorted(locations, key=lambda loc: -priority(*stats.get(str(loc['id']), (0, 0)), now))
+
+
+class LocationScheduler:
+    def __init__(self, kind):
+        self.kind = kind
+        self.stats = LocationStats()
+
+    def ranked(self):
+        return rank_locations(config.locations, self.stats.get(self.kind))
+
+    def pick(self):
+        location = self.ranked()[0]
+        logger.info(f'{self.kind}: {location["location"]} has the highest expected yield')
+        return location
+
+    def record(self, location_id, requests, found):
+        self.stats.record(self.kind, location_id, requests, found)
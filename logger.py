@@ -1,39 +1,113 @@
 import os
 import sys
-import glob
+import json
+import time
+import queue
+import atexit
 import logging
 import datetime
 from os.path import join
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 BASE_DIR = os.path.dirname(__file__)
 
+LOG_FORMAT = '[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s'
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """one json object per line"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'file': record.filename,
+            'line': record.lineno,
+            # tracebacks are already part of the message, the queue handler merges them in
+            'message': record.getMessage(),
+        }
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ModuleLevelFilter(logging.Filter):
+    """
+    drops records below the level set for their logger name or, as the scripts all log through
+    the root logger, for the module they were logged from. e.g. {'utils': 'INFO', 'urllib3': 'ERROR'}.
+    a level set for a logger name holds for its children too, 'urllib3' covers 'urllib3.connectionpool'
+    """
+
+    def __init__(self, levels):
+        super().__init__()
+        self.levels = {name: logging.getLevelName(level) if isinstance(level, str) else level
+                       for name, level in levels.items()}
+
+    def logger_level(self, name):
+        # the most specific name with a level wins
+        while name:
+            if name in self.levels:
+                return self.levels[name]
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        level = self.logger_level(record.name)
+        if level is None:
+            level = self.levels.get(record.module)
+        return level is None or record.levelno >= level
+
+
+def remove_old_logs(logs_folder, retention_days):
+    # logs of the old <date>.log naming, new ones are removed by the rotating handler
+    oldest = time.time() - retention_days * 24 * 60 * 60
+    for name in os.listdir(logs_folder):
+        path = join(logs_folder, name)
+        if len(name) == 14 and name.endswith('.log') and os.path.getmtime(path) < oldest:
+            os.remove(path)
+
+
+def get_logger(level=logging.DEBUG, levels=None, json_lines=False, retention_days=15, name=None):
+    """
+    log to logs/<name>.log and stdout. records are put on a queue and written by a background thread,
+    so logging never waits for the disk. the file is rotated at midnight and kept for `retention_days` days.
+
+    :param levels: minimum level per module or logger name
+    :param json_lines: write the file as json lines instead of text
+    :param name: name of the log file. the name of the script by default. every script has its own
+        file, so processes never rotate a file another one is writing to
+    """
+    global _listener
+    root = logging.getLogger()
+    if _listener is not None:
+        return root
 
-def get_logger():
     # make the logs folder
     logs_folder = join(BASE_DIR, 'logs')
     os.makedirs(logs_folder, exist_ok=True)
+    remove_old_logs(logs_folder, retention_days)
+
+    name = name or os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+    file_handler = TimedRotatingFileHandler(join(logs_folder, f'{name}.log'), when='midnight',
+                                            backupCount=retention_days, encoding='utf-8')
+    file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    levels = {'urllib3': logging.ERROR, **(levels or {})}
+    queue_handler.addFilter(ModuleLevelFilter(levels))
+
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    logging.getLogger('urllib3').setLevel(levels['urllib3'])
 
-    # remove logs older than 5 days
-    now = datetime.datetime.now()
-    existing_logs = glob.glob(join(logs_folder, '*.log'))
-    for log in existing_logs:
-        date_str = log[-14:-4]
-        if (now - datetime.datetime.strptime(date_str, '%Y-%m-%d')).days > 15:
-            print('removing log:', log)
-            os.remove(log)
-        else:
-            print('keeping log:', log)
-
-    current_logfile = join(logs_folder, f"{now.strftime('%Y-%m-%d')}.log")
-
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='[%(asctime)s] {%(filename)s:%(lineno)d} %(levelname)s - %(message)s',
-        handlers=(
-            logging.FileHandler(filename=current_logfile),
-            logging.StreamHandler(sys.stdout)
-        )
-    )
-
-    logging.getLogger('urllib3').setLevel(logging.ERROR)
-    return logging.getLogger()
+    _listener = QueueListener(log_queue, file_handler, stream_handler, respect_handler_level=True)
+    _listener.start()
+    # write what is still in the queue before the process exits
+    atexit.register(_listener.stop)
+    return root
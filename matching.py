@@ -0,0 +1,309 @@
+"""
+matching of faktakontroll hits with hemnet listings.
+
+the hits of a search are parsed and indexed once by (address, area bucket, floor). listings are then
+matched against the index, one or many at a time, e.g. all the listings of one building. only the
+buckets within the tolerances are looked at, and large candidate sets are checked on numpy arrays
+(a plain loop when numpy isn't installed).
+
+a hit matches a listing if
+    - the listing is a house type in `match_any_house_types`, or
+    - its area is the same (full match) or less than `match_area_tolerance` m² away (partial match)
+      and its floor at most `match_floor_tolerance` floors away.
+      a check is skipped when the listing has no area or floor, hits without one don't match
+
+the hits and person details of earlier searches are kept in the lookup cache, so the stored listings
+can be matched again after changing the thresholds, without a single new lookup:
+
+    python matching.py [--area-tolerance 1] [--floor-tolerance 1] [--location ID] [--dry-run]
+
+listings whose hits were evicted from the cache keep their matches. so do listings that would get a
+new match whose person details were evicted. details of persons already matched are kept
+"""
+import math
+import argparse
+import config
+from dataclasses import dataclass
+from records import Match
+from address import parse, parse_many, normalize
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = config.logger
+
+MATCH_AREA_TOLERANCE = getattr(config, 'match_area_tolerance', 1)
+MATCH_FLOOR_TOLERANCE = getattr(config, 'match_floor_tolerance', 1)
+# every hit matches listings of these house types
+MATCH_ANY_HOUSE_TYPES = tuple(getattr(config, 'match_any_house_types', ('Radhus', 'Villa')))
+
+# width of the area buckets in m²
+AREA_BUCKET = 1.0
+# candidate sets at least this large are checked with numpy. below, the array setup costs more than it saves
+VECTORIZE_MIN_CANDIDATES = 32
+
+# indexes of the latest searches. the listings of one building are searched with the same address
+INDEX_CACHE_SIZE = 64
+_indexes = {}
+
+@dataclass(frozen=True)
+class Thresholds:
+    area_tolerance: float = MATCH_AREA_TOLERANCE
+    floor_tolerance: int = MATCH_FLOOR_TOLERANCE
+    any_house_types: tuple = MATCH_ANY_HOUSE_TYPES
+
+
+def to_float(value):
+    try:
+        return float(value)
+    except:
+        return None
+
+
+def to_int(value):
+    try:
+        return int(value)
+    except:
+        return None
+
+
+def address_key(street_address):
+    """street and number of an address in lowercase, without floor or apartment"""
+    address = parse(street_address or '')
+    return f'{address.street} {address.number or ""}'.strip().lower()
+
+
+def area_bucket(area):
+    return int(area // AREA_BUCKET)
+
+
+def hit_name(hit):
+    name = hit.get('firstNames') or ''
+    if hit.get('middleNames'):
+        name += f' {hit["middleNames"]}'
+    if hit.get('lastNames'):
+        name += f' {hit["lastNames"]}'
+    return name
+
+
+def hit_area(hit):
+    try:
+        return hit['housingInfo']['area']
+    except:
+        return None
+
+
+class HitIndex:
+    """the hits of one faktakontroll search (or of many), indexed by (address, area bucket, floor)"""
+
+    def __init__(self, hits):
+        # hits without an address can't be matched
+        self.hits = [hit for hit in hits if 'fbfStreetAddress' in hit]
+        self.addresses = parse_many([hit['fbfStreetAddress'] or '' for hit in self.hits])
+        self.raw_areas = [hit_area(hit) for hit in self.hits]
+        # a missing area and an area of 0 are the same, neither matches a listing with an area
+        self.areas = [to_float(area) or None for area in self.raw_areas]
+        self.floors = [address.floor for address in self.addresses]
+
+        self.buckets = {}
+        self.bucket_keys = {}
+        for position, address in enumerate(self.addresses):
+            key = f'{address.street} {address.number or ""}'.strip().lower()
+            area = self.areas[position]
+            bucket = (area_bucket(area) if area is not None else None, self.floors[position])
+            self.buckets.setdefault((key,) + bucket, []).append(position)
+            self.bucket_keys.setdefault(key, set()).add(bucket)
+
+        if np is not None:
+            self.area_array = np.array([math.nan if area is None else area for area in self.areas], dtype=float)
+            self.floor_array = np.array([math.nan if floor is None else floor for floor in self.floors], dtype=float)
+
+    def __len__(self):
+        return len(self.hits)
+
+    def candidates(self, area, floor, thresholds, key=None):
+        """:return: sorted positions of the hits in the buckets within the tolerances"""
+        keys = [key] if key is not None else list(self.bucket_keys)
+        area_range = None
+        if area is not None:
+            area_range = range(area_bucket(area - thresholds.area_tolerance),
+                               area_bucket(area + thresholds.area_tolerance) + 1)
+        floor_range = None
+        if floor is not None:
+            floor_range = range(floor - thresholds.floor_tolerance, floor + thresholds.floor_tolerance + 1)
+
+        positions = []
+        for key in keys:
+            if area_range is not None and floor_range is not None:
+                for bucket in area_range:
+                    for bucket_floor in floor_range:
+                        positions.extend(self.buckets.get((key, bucket, bucket_floor), ()))
+                continue
+            for bucket, bucket_floor in self.bucket_keys.get(key, ()):
+                if area_range is not None and (bucket is None or bucket not in area_range):
+                    continue
+                if floor_range is not None and (bucket_floor is None or bucket_floor not in floor_range):
+                    continue
+                positions.extend(self.buckets[(key, bucket, bucket_floor)])
+        positions.sort()
+        return positions
+
+    def score(self, positions, area, floor, thresholds):
+        """:return: [(position, full match)] of the candidates within the tolerances"""
+        if np is not None and len(positions) >= VECTORIZE_MIN_CANDIDATES:
+            positions = np.array(positions)
+            matched = np.ones(len(positions), dtype=bool)
+            full = np.ones(len(positions), dtype=bool)
+            if area is not None:
+                areas = self.area_array[positions]
+                full = areas == area
+                # nan compares false, hits without an area drop out here
+                matched &= full | (np.abs(areas - area) < thresholds.area_tolerance)
+            if floor is not None:
+                matched &= np.abs(self.floor_array[positions] - floor) <= thresholds.floor_tolerance
+            return list(zip(positions[matched].tolist(), full[matched].tolist()))
+
+        scored = []
+        for position in positions:
+            full = True
+            if area is not None:
+                hit_area_value = self.areas[position]
+                if hit_area_value is None:
+                    continue
+                if hit_area_value != area:
+                    if not abs(hit_area_value - area) < thresholds.area_tolerance:
+                        continue
+                    full = False
+            if floor is not None:
+                hit_floor = self.floors[position]
+                if hit_floor is None or abs(hit_floor - floor) > thresholds.floor_tolerance:
+                    continue
+            scored.append((position, full))
+        return scored
+
+    def match(self, listing, thresholds=None, same_address=False):
+        """
+        :param same_address: only match hits with the street and number of the listing
+        :return: [(position, full match)] of the matching hits, in the order of the hits
+        """
+        thresholds = thresholds or Thresholds()
+        key = address_key(listing.get('street_address')) if same_address else None
+        if listing.get('house_type') in thresholds.any_house_types:
+            return [(position, True) for position in self.candidates(None, None, thresholds, key)]
+        area = to_float(listing.get('area')) or None
+        floor = to_int(listing.get('floor'))
+        return self.score(self.candidates(area, floor, thresholds, key), area, floor, thresholds)
+
+    def match_many(self, listings, thresholds=None, same_address=False):
+        """:return: the result of `match` for every listing, in the same order"""
+        thresholds = thresholds or Thresholds()
+        return [self.match(listing, thresholds, same_address) for listing in listings]
+
+    def to_match(self, position, full_match, details):
+        """:param details: person details of the hit, see Faktakontroll.get_more_details"""
+        address = self.addresses[position]
+        return Match(
+            full_match=full_match,
+            numbers=details.get('numbers') or [],
+            age=details.get('age'),
+            gender=details.get('gender'),
+            person_number=details.get('person_number'),
+            area=self.raw_areas[position],
+            name=hit_name(self.hits[position]),
+            floor=address.floor,
+            apartment=address.apartment,
+            street_address=self.hits[position]['fbfStreetAddress'],
+        )
+
+
+def get_index(hits):
+    """:return: the HitIndex of `hits`, built once for the listings of a building that get the same hits"""
+    # every field the index reads is in the key, a refreshed search with a changed area or name gets a new index
+    key = tuple((hit.get('id'), hit.get('fbfStreetAddress'), hit_area(hit), hit_name(hit)) for hit in hits)
+    index = _indexes.pop(key, None)
+    if index is None:
+        index = HitIndex(hits)
+        if len(_indexes) >= INDEX_CACHE_SIZE:
+            # dicts keep the insertion order, the first one was used the longest time ago
+            del _indexes[next(iter(_indexes))]
+    _indexes[key] = index
+    return index
+
+
+def rematch(location, results, thresholds, address_cache, entity_cache):
+    """
+    match the searched listings of a location again with the cached hits and person details.
+    listings of the same building are matched against one index
+
+    :return: ids of the listings whose matches changed. `results` is updated in place
+    """
+    # the hits were cached under the normalized search string of the listing
+    buildings = {}
+    for property_id, entry in results.items():
+        if entry.get('complete'):
+            buildings.setdefault(normalize(f'{entry["street_address"]}, {entry["city"]}'), []).append(property_id)
+
+    changed_ids = set()
+    skipped = 0
+    for search_key, property_ids in buildings.items():
+        hits = address_cache.get(search_key, max_age=math.inf)
+        if hits is None:
+            skipped += len(property_ids)
+            continue
+        index = HitIndex(hit['individual'] for hit in hits if hit.get('individual'))
+        listings = [results[property_id] for property_id in property_ids]
+        for entry, scored in zip(listings, index.match_many(listings, thresholds)):
+            # details of evicted persons are taken from the stored match of the same person
+            stored = {(match['name'], match['street_address']): match for match in entry['matches'] or []}
+            matches = []
+            for position, full_match in scored:
+                details = entity_cache.get(str(index.hits[position]['id']), max_age=math.inf)
+                if details is None:
+                    details = stored.get((hit_name(index.hits[position]), index.hits[position]['fbfStreetAddress']))
+                if details is None:
+                    break
+                matches.append(index.to_match(position, full_match, details))
+            else:
+                if (entry['matches'] or []) != matches:
+                    entry['matches'] = matches
+                    changed_ids.add(entry['id'])
+                continue
+            # a new match without cached details would need a lookup, the listing keeps its matches
+            skipped += 1
+    logger.info(f'{location["location"]}: {len(changed_ids)} of {sum(map(len, buildings.values()))} '
+                f'listings matched differently. {skipped} without cached hits or person details')
+    return changed_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='match the stored listings again with the cached faktakontroll hits')
+    parser.add_argument('--area-tolerance', type=float, default=MATCH_AREA_TOLERANCE)
+    parser.add_argument('--floor-tolerance', type=int, default=MATCH_FLOOR_TOLERANCE)
+    parser.add_argument('--location', help='id of the only location to match again')
+    parser.add_argument('--dry-run', action='store_true', help='only log how many listings would change')
+    args = parser.parse_args()
+
+    from utils import ADDRESS_CACHE_TTL, ADDRESS_CACHE_MAX_ENTRIES, ENTITY_CACHE_TTL, ENTITY_CACHE_MAX_ENTRIES
+    from storage import get_storage
+    from export import Exporter
+    from ttl_cache import TTLCache
+
+    thresholds = Thresholds(args.area_tolerance, args.floor_tolerance)
+    address_cache = TTLCache('address', ADDRESS_CACHE_TTL, ADDRESS_CACHE_MAX_ENTRIES)
+    entity_cache = TTLCache('entity', ENTITY_CACHE_TTL, ENTITY_CACHE_MAX_ENTRIES)
+    storage = get_storage()
+    exporter = Exporter()
+    for location in config.locations:
+        if args.location and str(location['id']) != args.location:
+            continue
+        results = storage.load(location['id'])
+        changed_ids = rematch(location, results, thresholds, address_cache, entity_cache)
+        if changed_ids and not args.dry_run:
+            storage.save(location['id'], results, changed_ids)
+            exporter.export(location, results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,236 @@
+"""
+counters and latency histograms of the scripts, exported in the prometheus text format.
+
+every script writes its metrics to <metrics_dir>/<script>.prom at the end of a run (and at most every
+`metrics_write_interval` seconds in the loops), which the textfile collector of the node exporter can pick up.
+with `metrics_port` set they are also served on http://<metrics_host>:<metrics_port>/metrics while the script runs.
+
+    SAVE_SECONDS = metrics.histogram('scraper_save_seconds', 'time spent saving listings', ['backend'])
+    with SAVE_SECONDS.time(backend='json'):
+        ...
+"""
+import os
+import sys
+import time
+import bisect
+import threading
+import config
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from atomic_io import atomic_write
+
+logger = config.logger
+
+# None disables the http endpoint
+METRICS_PORT = getattr(config, 'metrics_port', None)
+METRICS_HOST = getattr(config, 'metrics_host', '127.0.0.1')
+METRICS_WRITE_INTERVAL = getattr(config, 'metrics_write_interval', 60)
+
+# upper bounds in seconds. covers everything from parsing a page to a slow export
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=()):
+    pairs = [f'{name}="{escape(value)}"' for name, value in list(zip(names, values)) + list(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric(ABC):
+    kind = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def label_values(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f'{self.name} takes the labels {self.label_names}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for label_values in sorted(self.values):
+                lines.extend(self.render_value(label_values, self.values[label_values]))
+        return lines
+
+    @abstractmethod
+    def render_value(self, label_values, value):
+        """:return: the exposition lines of one set of label values"""
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(self.label_values(labels), 0)
+
+    def render_value(self, label_values, value):
+        return [f'{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}']
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                # one count per bucket plus +Inf, the sum and the total count
+                counts = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """observe the duration of the block. works as a decorator as well"""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render_value(self, label_values, counts):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = format_labels(self.label_names, label_values, [('le', format_value(bound))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = format_labels(self.label_names, label_values)
+        lines.append(f'{self.name}_sum{labels} {format_value(counts[-2])}')
+        lines.append(f'{self.name}_count{labels} {counts[-1]}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def get_or_create(self, cls, name, *args, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f'{name} is already registered as a {metric.kind}')
+            return metric
+
+    def render(self):
+        lines = []
+        with self.lock:
+            metrics = sorted(self.metrics.values(), key=lambda metric: metric.name)
+        for metric in metrics:
+            if metric.values:
+                lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name, documentation, label_names=()):
+    return registry.get_or_create(Counter, name, documentation, label_names)
+
+
+def histogram(name, documentation, label_names=(), buckets=DEFAULT_BUCKETS):
+    return registry.get_or_create(Histogram, name, documentation, label_names, buckets=buckets)
+
+
+def render():
+    return registry.render()
+
+
+# used by several modules
+SLEEP_SECONDS = counter('scraper_sleep_seconds_total', 'time spent sleeping on purpose', ['reason'])
+CACHE_REQUESTS = counter('scraper_cache_requests_total', 'cache lookups by cache and result', ['cache', 'result'])
+
+
+@contextmanager
+def sleeping(reason):
+    """count the duration of the block as time slept for `reason`"""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        SLEEP_SECONDS.inc(time.perf_counter() - started_at, reason=reason)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+_job = os.path.splitext(os.path.basename(sys.argv[0]))[0] or 'python'
+_last_saved_at = 0
+_server = None
+
+
+def setup(job=None, port=METRICS_PORT):
+    """name the metrics file after `job` and start the http endpoint if a port is configured"""
+    global _job, _server
+    if job:
+        _job = job
+    if port and _server is None:
+        try:
+            _server = ThreadingHTTPServer((METRICS_HOST, port), MetricsHandler)
+        except OSError as e:
+            logger.error(f'could not serve metrics on port {port}. error: {e}')
+            return
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+        logger.info(f'serving metrics on http://{METRICS_HOST}:{port}/metrics')
+
+
+def save(force=False):
+    """write the metrics file. without `force` only if the last write is `metrics_write_interval` seconds old"""
+    global _last_saved_at
+    # read on every write, a cassette run moves CACHE_DIR after this module is imported
+    metrics_dir = getattr(config, 'metrics_dir', os.path.join(config.CACHE_DIR, 'metrics'))
+    if not metrics_dir or not force and time.monotonic() - _last_saved_at < METRICS_WRITE_INTERVAL:
+        return
+    _last_saved_at = time.monotonic()
+    try:
+        with atomic_write(os.path.join(metrics_dir, f'{_job}.prom'), 'w', encoding='utf-8') as f:
+            f.write(render())
+    except Exception as e:
+        logger.error(f'could not save metrics. error: {e}')
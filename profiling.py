@@ -0,0 +1,159 @@
+"""
+profiling of a whole run and timers for the named stages of the scripts.
+
+    python search_hemnet.py --profile
+    python search_faktakontroll.py --profile --iterations 50
+
+with --profile the run (or the first N steps of the faktakontroll loop) is profiled with cProfile
+and tracemalloc. logs/<time>_<script>.pstats can be opened with `python -m pstats` or snakeviz,
+logs/<time>_<script>.txt has the time per stage, the slowest functions and the top allocations.
+
+stages are timed all the time, profiling or not:
+
+    with profiling.stage('parse'):
+        ...
+
+stages can be nested. the time of a stage includes the stages inside it, its self time doesn't
+"""
+import os
+import io
+import time
+import pstats
+import cProfile
+import datetime
+import threading
+import tracemalloc
+import config
+import metrics
+from contextlib import contextmanager
+
+logger = config.logger
+
+LOGS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'logs')
+# number of frames kept per allocation. more frames show the callers, but make tracing slower
+PROFILE_TRACEMALLOC_FRAMES = getattr(config, 'profile_tracemalloc_frames', 5)
+# rows of the function and allocation tables in the report
+PROFILE_TOP = getattr(config, 'profile_top', 40)
+# faktakontroll loop steps profiled when --iterations is not given
+PROFILE_ITERATIONS = getattr(config, 'profile_iterations', 100)
+
+STAGE_SECONDS = metrics.histogram('scraper_stage_seconds', 'time spent in the named stages of the scripts',
+                                  ['stage'])
+
+
+class StageTimes:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # stage: [count, total seconds, self seconds]
+        self.values = {}
+        self.local = threading.local()
+
+    @contextmanager
+    def stage(self, name):
+        # time spent in nested stages is subtracted from the self time of the outer stage
+        stack = getattr(self.local, 'stack', None)
+        if stack is None:
+            stack = self.local.stack = []
+        stack.append(0.0)
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started_at
+            nested = stack.pop()
+            if stack:
+                stack[-1] += duration
+            STAGE_SECONDS.observe(duration, stage=name)
+            with self.lock:
+                count, total, self_time = self.values.get(name, (0, 0.0, 0.0))
+                self.values[name] = (count + 1, total + duration, self_time + duration - nested)
+
+    def reset(self):
+        with self.lock:
+            self.values = {}
+
+    def report(self, wall_time=None):
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: item[1][2], reverse=True)
+        lines = [f'{"stage":<16}{"calls":>8}{"total s":>12}{"self s":>12}{"mean ms":>12}{"% of run":>10}']
+        for name, (count, total, self_time) in values:
+            share = f'{self_time / wall_time * 100:.1f}' if wall_time else '-'
+            lines.append(f'{name:<16}{count:>8}{total:>12.2f}{self_time:>12.2f}{total / count * 1000:>12.1f}{share:>10}')
+        return '\n'.join(lines)
+
+
+stage_times = StageTimes()
+stage = stage_times.stage
+
+
+class Profiler:
+    """profiles the block with cProfile and tracemalloc if `enabled` and writes the reports into the logs folder"""
+
+    def __init__(self, name, enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.profile = None
+        self.started_at = None
+
+    def __enter__(self):
+        if not self.enabled:
+            return self
+        stage_times.reset()
+        tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+        self.profile = cProfile.Profile()
+        self.started_at = time.perf_counter()
+        self.profile.enable()
+        return self
+
+    def __exit__(self, *exc_info):
+        if not self.enabled:
+            return False
+        self.profile.disable()
+        wall_time = time.perf_counter() - self.started_at
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        try:
+            self.save(wall_time, snapshot, peak)
+        except Exception as e:
+            logger.error(f'could not save the profile of {self.name}. error: {e}')
+        return False
+
+    def save(self, wall_time, snapshot, peak_memory):
+        os.makedirs(LOGS_DIR, exist_ok=True)
+        base_name = os.path.join(LOGS_DIR, f'{datetime.datetime.now():%Y-%m-%d_%H-%M-%S}_{self.name}')
+        self.profile.dump_stats(f'{base_name}.pstats')
+
+        functions = io.StringIO()
+        stats = pstats.Stats(self.profile, stream=functions)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP)
+        stats.sort_stats(pstats.SortKey.TIME).print_stats(PROFILE_TOP)
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+        allocations = []
+        for statistic in snapshot.statistics('traceback')[:PROFILE_TOP]:
+            allocations.append(f'{statistic.size / 1024:10.1f} kB in {statistic.count:7d} blocks')
+            allocations.extend(f'    {line}' for line in statistic.traceback.format(limit=PROFILE_TRACEMALLOC_FRAMES))
+
+        with open(f'{base_name}.txt', 'w', encoding='utf-8') as f:
+            f.write(f'{self.name}: {wall_time:.1f}s, peak traced memory {peak_memory / 1024 / 1024:.1f} MB\n\n')
+            f.write('stages\n')
+            f.write(stage_times.report(wall_time))
+            f.write('\n\nallocations still alive at the end, by traceback\n')
+            f.write('\n'.join(allocations))
+            f.write('\n\nfunctions\n')
+            f.write(functions.getvalue())
+        logger.info(f'{self.name} took {wall_time:.1f}s. profile saved as: {base_name}.txt\n'
+                    f'{stage_times.report(wall_time)}')
+
+
+def add_arguments(parser, iterations=False):
+    parser.add_argument('--profile', action='store_true',
+                        help='profile the run with cProfile and tracemalloc. reports are saved in the logs folder')
+    if iterations:
+        parser.add_argument('--iterations', type=int, default=None,
+                            help=f'stop after this many steps of the loop. {PROFILE_ITERATIONS} with --profile')
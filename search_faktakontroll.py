@@ -1,105 +1,221 @@
-import os
-import json
 import time
 import pytz
 import config
-import random
+import argparse
+import cassette
+import metrics
+import profiling
 import datetime
-from utils import Faktakontroll, Hemnet
+from storage import get_storage, STORAGE_BACKEND
+from seen_index import get_seen_index
+from work_queue import PendingQueue, is_pending
+from export import Exporter
+from location_stats import ADAPTIVE_LOCATIONS, LocationScheduler
+from utils import Faktakontroll
 
-SOLD_PROPERTY_CACHE_FILE = os.path.join(config.CACHE_DIR, 'sold-cache.json')
 logger = config.logger
 
+OFFICE_HOURS_START = 8
+OFFICE_HOURS_END = 20
+# seconds to wait when there is nothing left to search
+NO_WORK_WAIT = 15 * 60
+# searched results written to the location caches at once. a json cache is rewritten as a whole on every save
+FK_SAVE_BATCH = getattr(config, 'faktakontroll_save_batch', 1 if STORAGE_BACKEND == 'sqlite' else 20)
+# fields of a result set by the faktakontroll search
+SEARCH_FIELDS = ('matches', 'complete', 'try_count')
+# the cache counters and http timings are logged every this many searches, when there is no work left and at the end
+FK_STATS_STEPS = getattr(config, 'faktakontroll_stats_steps', 100)
+
 
 class Location:
     def __init__(self):
         self.last_loc_index = 0
+        self.queue = PendingQueue()
+        self.storage = get_storage()
+        self.scheduler = LocationScheduler('faktakontroll')
+        self.seen = get_seen_index()
+
+        # locations cached before the queue existed are added to it once
+        for loc in config.locations:
+            if not self.queue.is_seeded(loc['id']):
+                self.queue.seed(loc['id'], self.storage.load(loc['id']))
 
     @property
     def next(self) -> (dict or None, str or None):
         """
+        every location is tried once at most, in case there is no new hemnet result for some of them
         :return: hemnet result, hemnet location
         """
-        locations = config.locations
-        new_loc_index = (self.last_loc_index + 1) % len(locations)
-        self.last_loc_index = new_loc_index
-        loc = locations[new_loc_index]
+        if ADAPTIVE_LOCATIONS:
+            # the locations are ranked once, the one with the best match rate that still has queued results is taken
+            for loc in self.scheduler.ranked():
+                info, hemnet_location = self.next_of(loc)
+                if info:
+                    return info, hemnet_location
+            return None, None
 
-        # read the cache file
-        cache_file = os.path.join(config.CACHE_DIR, f'{loc["id"]}.json')
+        locations = config.locations
+        for _ in locations:
+            self.last_loc_index = (self.last_loc_index + 1) % len(locations)
+            info, hemnet_location = self.next_of(locations[self.last_loc_index])
+            if info:
+                return info, hemnet_location
+        return None, None
+
+    def next_of(self, loc):
+        # take the first queued result of this location
         try:
-            logger.debug(f'reading cache: {cache_file}')
-            with open(cache_file, encoding='utf-8-sig') as f:
-                cache = json.load(f)
-                for loc_id, info in cache.items():
-                    # check on faktakontroll if there is no match found previously and the script
-                    # tried to find it less than a certain times
-                    if info.get('matches') is None and info['try_count'] < config.fk_max_retry:
-                        return info, loc
-                return None, None
+            while True:
+                property_id, info = self.queue.peek(loc['id'])
+                if property_id is None:
+                    return None, None
+                # the same listing is searched only for the location it was found in first
+                owner = self.seen.owner(property_id)
+                if owner not in (None, str(loc['id'])):
+                    info = None
+                elif info is None:
+                    # queued by an older version, without the entry
+                    info = self.storage.get(loc['id'], property_id)
+                if info and is_pending(info):
+                    return info, loc
+                # the result was removed or already completed somewhere else
+                self.queue.remove(loc['id'], property_id)
         except Exception as e:
-            logger.error(f'could not read {cache_file}. error: {e}')
+            logger.error(f'could not read queue of {loc["location"]}. error: {e}')
             return None, None
 
-
-def main():
-    location = Location()
-    faktakontroll = Faktakontroll()
-    while True:
-
-        # run the script between 8 - 20 swedish time
-        if config.faktakontroll_limited:
-            now = datetime.datetime.now(pytz.timezone('Europe/Stockholm'))
-            hour = now.hour
-            minute = str(now.minute).rjust(2, '0')
-            if hour < 8 or hour > 20:
-                print(f'current time: {hour}:{minute}. office hour not started yet')
-                time.sleep(15 * 60)
-                continue
+    def done(self, hemnet_result, hemnet_location):
+        self.queue.finish(hemnet_location['id'], hemnet_result, is_pending(hemnet_result))
+
+
+def seconds_until_office_hours(now=None):
+    """
+    :return: 0 if faktakontroll can be searched now, otherwise seconds until 8:00 swedish time
+    """
+    if not config.faktakontroll_limited:
+        return 0
+    tz = pytz.timezone('Europe/Stockholm')
+    now = now or datetime.datetime.now(tz)
+    # run the script between 8 - 20 swedish time
+    if OFFICE_HOURS_START <= now.hour <= OFFICE_HOURS_END:
+        return 0
+    start_date = now.date() if now.hour < OFFICE_HOURS_START else now.date() + datetime.timedelta(days=1)
+    start = tz.localize(datetime.datetime.combine(start_date, datetime.time(OFFICE_HOURS_START)))
+    return (start - now).total_seconds()
+
+
+class Worker:
+    """searches one queued hemnet result on faktakontroll per step"""
+
+    def __init__(self, faktakontroll=None, exporter=None):
+        self.location = Location()
+        self.faktakontroll = faktakontroll or Faktakontroll()
+        self.exporter = exporter or Exporter()
+        self.searches = 0
+        # results searched before the last run stopped
+        self.save_results()
+
+    def save_results(self):
+        """
+        write the searched results to the location caches. only the fields set by the search are
+        written over the stored entries, other changes made since they were queued are kept
+        """
+        locations_by_id = {str(location['id']): location for location in config.locations}
+        for location_id, entries in self.location.queue.unsaved().items():
+            def copy_search_fields(entry):
+                searched = entries[str(entry['id'])]
+                changed = any(entry[field] != searched[field] for field in SEARCH_FIELDS)
+                for field in SEARCH_FIELDS:
+                    entry[field] = searched[field]
+                return changed
+
+            self.location.storage.update(location_id, entries, copy_search_fields)
+            self.location.queue.saved(location_id, entries)
+            # if matches found then the excel file has to be saved again
+            if location_id in locations_by_id and any(entry['matches'] for entry in entries.values()):
+                self.exporter.mark_dirty(locations_by_id[location_id])
+
+    def step(self):
+        """
+        :return: seconds to wait before the next step
+        """
+        wait = seconds_until_office_hours()
+        if wait:
+            logger.info(f'office hour not started yet. waiting {wait / 60:.0f} minutes')
+            return wait
 
         try:
-            hemnet_result = None
-            hemnet_location = None
-
-            # try to get location for the same number of times as the  total number of locations
-            #  in case, new search result for a location on hemnet not found
-            for _ in config.locations:
-                hemnet_result, hemnet_location = location.next
-                if hemnet_result:
-                    break
+            hemnet_result, hemnet_location = self.location.next
 
             if not hemnet_result or not hemnet_location:
+                self.save_results()
+                self.exporter.flush(force=True)
                 logger.info('new hemnet result not found')
-                time.sleep(15 * 60)
-                continue
+                self.faktakontroll.log_stats()
+                return NO_WORK_WAIT
 
-            hemnet = Hemnet(hemnet_location)
             fk_search_str = f'{hemnet_result["street_address"]}, {hemnet_result["city"]}'
             logger.info(f'searching faktakontroll ({hemnet_location["location"]}): {fk_search_str}')
 
             # search on faktakontroll
-            results = faktakontroll.search(fk_search_str)
+            results = self.faktakontroll.search(fk_search_str)
             matches_found = False
 
             # if results is not none (results were returned from fk)
             if results is not None:
                 # find matches from faktakontroll search results
-                matches = faktakontroll.find_matches(hemnet_result, results)
+                matches = self.faktakontroll.find_matches(hemnet_result, results)
                 matches_found = len(matches) > 0
                 logger.info(f'{len(results)} results found on faktakontroll. {len(matches)} matches')
                 # save the matches on hemnet cache and set complete as True
-                hemnet.results[hemnet_result["id"]]['matches'] = matches
-                hemnet.results[hemnet_result["id"]]['complete'] = True
+                hemnet_result['matches'] = matches
+                hemnet_result['complete'] = True
 
-            hemnet.results[hemnet_result["id"]]['try_count'] += 1
-            hemnet.save_results()
+            hemnet_result['try_count'] += 1
+            self.location.done(hemnet_result, hemnet_location)
+            self.location.scheduler.record(hemnet_location['id'], 1, 1 if matches_found else 0)
 
-            # if matches found then save the excel file
-            if matches_found:
-                hemnet.save_xlsx()
+            if self.location.queue.unsaved_count() >= FK_SAVE_BATCH:
+                self.save_results()
+            self.exporter.flush()
+            self.searches += 1
+            if self.searches % FK_STATS_STEPS == 0:
+                self.faktakontroll.log_stats()
 
         except Exception as e:
             logger.critical(e)
+        return 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    cassette.add_arguments(parser)
+    profiling.add_arguments(parser, iterations=True)
+    args = parser.parse_args()
+    cassette.use_arguments(args)
+    metrics.setup()
+    iterations = args.iterations
+    if iterations is None and args.profile:
+        iterations = profiling.PROFILE_ITERATIONS
+
+    worker = Worker()
+    with profiling.Profiler('search_faktakontroll', args.profile):
+        step = 0
+        while iterations is None or step < iterations:
+            step += 1
+            wait = worker.step()
+            metrics.save(force=bool(wait))
+            if wait and (cassette.replaying() or iterations is not None):
+                # nothing else will come from the recorded traffic, and waiting would only skew the profile
+                cassette.log_stats()
+                break
+            if wait:
+                with metrics.sleeping('idle'):
+                    time.sleep(wait)
+        worker.save_results()
+        worker.exporter.flush(force=True)
+        worker.faktakontroll.log_stats()
+    metrics.save(force=True)
 
 
 if __name__ == '__main__':
@@ -1,43 +1,76 @@
 import os
 import config
+import argparse
+import cassette
+import metrics
+import profiling
+import http_cache
 from utils import Hemnet
+from location_stats import ADAPTIVE_LOCATIONS, LocationScheduler
+from work_queue import PendingQueue
 
-LAST_LOCATION_INDEX_FILE = os.path.join(config.CACHE_DIR, 'last_loc.txt')
+LAST_LOCATION_INDEX_NAME = 'last_loc.txt'
 
 
 def get_location():
+    if ADAPTIVE_LOCATIONS:
+        return LocationScheduler('search').pick()
+
     locations = config.locations
+    last_location_index_file = os.path.join(config.CACHE_DIR, LAST_LOCATION_INDEX_NAME)
 
     # read index of last searched location
     try:
-        with open(LAST_LOCATION_INDEX_FILE) as f:
+        with open(last_location_index_file) as f:
             last_loc_index = int(f.read())
             new_loc_index = (last_loc_index + 1) % len(locations)
     except:
         new_loc_index = 0
 
     # save the index of current location
-    with open(LAST_LOCATION_INDEX_FILE, 'w') as f:
+    with open(last_location_index_file, 'w') as f:
         f.write(str(new_loc_index))
 
     return locations[new_loc_index]
 
 
-def main():
+def run(hemnet, queue):
     logger = config.logger
-    location = get_location()
-    hemnet = Hemnet(location)
+    queue.seed(hemnet.location_id, hemnet.results)
+    known_ids = set(hemnet.results)
+    request_count = hemnet.fetcher.request_count
     search_results = hemnet.search()
 
     results_count = len(search_results)
-    logger.info(f'{results_count} new results found for: {location["location"]}')
+    logger.info(f'{results_count} new results found for: {hemnet.location_name}')
 
-    for i, search_result in enumerate(search_results):
-        if i == (results_count - 1) or (i + 1) % 10 == 0 and i != 1:
-            logger.info(f'{i + 1} of {results_count} properties searched on hemnet')
-        hemnet.get_details(search_result)
+    hemnet.get_details_many(search_results)
 
     hemnet.save_results()
+    http_cache.log_stats()
+    cassette.log_stats()
+
+    # hand the new results over to the faktakontroll loop
+    new_ids = [property_id for property_id in hemnet.results if property_id not in known_ids]
+    queue.push(hemnet.location_id, new_ids, hemnet.results)
+    logger.info(f'{len(new_ids)} results added to the faktakontroll queue')
+    LocationScheduler('search').record(hemnet.location_id, hemnet.fetcher.request_count - request_count, len(new_ids))
+    metrics.save(force=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    cassette.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    cassette.use_arguments(args)
+    metrics.setup()
+    with profiling.Profiler('search_hemnet', args.profile):
+        hemnet = Hemnet(get_location())
+        try:
+            run(hemnet, PendingQueue())
+        finally:
+            hemnet.close()
 
 
 if __name__ == '__main__':
@@ -1,67 +1,82 @@
 import os
 import config
+import argparse
+import cassette
+import metrics
+import profiling
+import http_cache
 from utils import Hemnet
-import json
+from export import Exporter
+from sold_index import get_sold_index
+from location_stats import ADAPTIVE_LOCATIONS, LocationScheduler
 
-LAST_LOCATION_INDEX_FILE = os.path.join(config.CACHE_DIR, 'last_sold_loc.txt')
-SOLD_PROPERTY_CACHE_FILE = os.path.join(config.CACHE_DIR, 'sold-cache.json')
+LAST_LOCATION_INDEX_NAME = 'last_sold_loc.txt'
 
 
 def get_location():
+    if ADAPTIVE_LOCATIONS:
+        return LocationScheduler('sold').pick()
+
     locations = config.locations
+    last_location_index_file = os.path.join(config.CACHE_DIR, LAST_LOCATION_INDEX_NAME)
 
     # read index of last searched location
     try:
-        with open(LAST_LOCATION_INDEX_FILE) as f:
+        with open(last_location_index_file) as f:
             last_loc_index = int(f.read())
             new_loc_index = (last_loc_index + 1) % len(locations)
     except:
         new_loc_index = 0
 
     # save the index of current location
-    with open(LAST_LOCATION_INDEX_FILE, 'w') as f:
+    with open(last_location_index_file, 'w') as f:
         f.write(str(new_loc_index))
 
     return locations[new_loc_index]
 
 
-def main():
+def run(hemnet, exporter=None):
     logger = config.logger
-    location = get_location()
-    hemnet = Hemnet(location)
-
-    # load old sold properties cache
-    try:
-        with open(SOLD_PROPERTY_CACHE_FILE) as f:
-            sold_property_cache = json.load(f)
-    except:
-        sold_property_cache = {}
+    request_count = hemnet.fetcher.request_count
+    sold_index = get_sold_index()
+    sold_index.refresh()
 
-    logger.info(f'getting list of sold properties for: {location["location"]}')
+    logger.info(f'getting list of sold properties for: {hemnet.location_name}')
 
-    sold_properties_links = hemnet.search_sold_properties()
-    new_sold_properties = [spl for spl in sold_properties_links if spl not in sold_property_cache]
+    sold_properties_links = hemnet.search_sold_properties(sold_index)
+    new_sold_properties = [spl for spl in sold_properties_links if spl not in sold_index]
     logger.info(f'{len(sold_properties_links)} sold properties found. {len(new_sold_properties)} new')
 
     for i, sold_prop_link in enumerate(new_sold_properties):
         sold = hemnet.get_sold_property_date(sold_prop_link)
         if sold:
             logger.debug(f'({i + 1}/{len(new_sold_properties)}) {sold["id"]}: {sold["date"]}')
-            sold_property_cache[sold_prop_link] = sold
+            sold_index.add(sold_prop_link, sold['id'], sold['date'])
 
-    all_sold_properties = {sp['id']: sp['date'] for sp in sold_property_cache.values()}
+    # the sold dates go to every location holding the listings, not only the one searched
+    exporter = exporter or Exporter()
+    updated = sold_index.join(hemnet.storage, hemnet.seen, config.locations, exporter)
+    exporter.flush(force=True)
+    http_cache.log_stats()
+    cassette.log_stats()
+    LocationScheduler('sold').record(hemnet.location_id, hemnet.fetcher.request_count - request_count,
+                                     sum(updated.values()))
+    metrics.save(force=True)
 
-    try:
-        with open(SOLD_PROPERTY_CACHE_FILE, 'w', encoding='utf-8') as f:
-            json.dump(sold_property_cache, f)
-        logger.info('saved sold property cache')
-    except:
-        logger.error('could not save sold property cache')
 
-    for property_id in hemnet.results.keys():
-        if property_id in all_sold_properties:
-            hemnet.results[property_id]['sold_date'] = all_sold_properties[property_id]
-    hemnet.save_results()
+def main():
+    parser = argparse.ArgumentParser()
+    cassette.add_arguments(parser)
+    profiling.add_arguments(parser)
+    args = parser.parse_args()
+    cassette.use_arguments(args)
+    metrics.setup()
+    with profiling.Profiler('search_hemnet_sold', args.profile):
+        hemnet = Hemnet(get_location(), load_results=False)
+        try:
+            run(hemnet)
+        finally:
+            hemnet.close()
 
 
 if __name__ == '__main__':
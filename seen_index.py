@@ -0,0 +1,92 @@
+"""
+every hemnet listing id we hold, over all locations, with the location it belongs to.
+
+listings shown in several overlapping locations are fetched and searched on faktakontroll only
+for the first location they were found in. the ids are kept on disk and loaded into a dict,
+so a membership check is a single hash lookup.
+
+caches written before the index existed can hold the same listing in several locations. every
+location holding a listing is kept as well, for updates that have to reach all copies (sold dates)
+"""
+import os
+import sqlite3
+import config
+from storage import get_storage
+
+logger = config.logger
+
+SEEN_DB_NAME = 'seen.db'
+
+
+class SeenIndex:
+    def __init__(self, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, SEEN_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, location_id TEXT NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS holders (id TEXT NOT NULL, location_id TEXT NOT NULL, '
+                              'PRIMARY KEY (id, location_id))')
+            # locations whose cache was added to both tables. "seeded" of older versions only filled seen
+            self.conn.execute('CREATE TABLE IF NOT EXISTS seeded_holders (location_id TEXT PRIMARY KEY)')
+        self.owners = dict(self.conn.execute('SELECT id, location_id FROM seen'))
+
+    def __contains__(self, property_id):
+        return str(property_id) in self.owners
+
+    def __len__(self):
+        return len(self.owners)
+
+    def owner(self, property_id):
+        """:return: id of the location the listing was first found in"""
+        return self.owners.get(str(property_id))
+
+    def holders(self, property_ids):
+        """:return: {property id: [ids of every location holding the listing]} of the known listings"""
+        holders = {}
+        property_ids = [str(property_id) for property_id in property_ids]
+        # sqlite limits the number of parameters of a query
+        for start in range(0, len(property_ids), 500):
+            chunk = property_ids[start:start + 500]
+            rows = self.conn.execute(f'SELECT id, location_id FROM holders WHERE id IN ({", ".join("?" * len(chunk))})',
+                                     chunk)
+            for property_id, location_id in rows:
+                holders.setdefault(property_id, []).append(location_id)
+        return holders
+
+    def refresh(self):
+        """load the ids other processes added since this index was created"""
+        self.owners = dict(self.conn.execute('SELECT id, location_id FROM seen'))
+
+    def add(self, location_id, property_ids):
+        held = [(str(property_id), str(location_id)) for property_id in property_ids]
+        new = [(property_id, location_id) for property_id, location_id in held if property_id not in self.owners]
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO seen (id, location_id) VALUES (?, ?)', new)
+            self.conn.executemany('INSERT OR IGNORE INTO holders (id, location_id) VALUES (?, ?)', held)
+        for property_id, location_id in new:
+            self.owners[property_id] = location_id
+
+    def seed(self, storage, locations):
+        """add the listings of the existing location caches. done only once per location"""
+        for location in locations:
+            location_id = str(location['id'])
+            if self.conn.execute('SELECT 1 FROM seeded_holders WHERE location_id = ?', (location_id,)).fetchone():
+                continue
+            self.add(location_id, storage.load(location_id).keys())
+            with self.conn:
+                self.conn.execute('INSERT OR IGNORE INTO seeded_holders (location_id) VALUES (?)', (location_id,))
+            logger.info(f'listings of {location["location"]} added to the seen index. {len(self)} in total')
+
+
+_seen_index = None
+
+
+def get_seen_index():
+    """the index shared by everything in this process, filled from the location caches on first use"""
+    global _seen_index
+    if _seen_index is None:
+        _seen_index = SeenIndex()
+        _seen_index.seed(get_storage(), config.locations)
+    return _seen_index
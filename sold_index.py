@@ -0,0 +1,155 @@
+"""
+the sold date of every sold hemnet listing found, over all locations.
+
+sold listings are only ever added, each one gets the next sequence number. the join remembers the
+last sequence number it applied, so every run only looks at the sold dates added since, finds all
+the locations holding those listings through the seen index and writes just the changed entries.
+the reports of those locations are marked dirty and nothing else is touched.
+
+the old sold-cache.json is imported once, on first use
+"""
+import os
+import json
+import sqlite3
+import config
+
+logger = config.logger
+
+SOLD_DB_NAME = 'sold.db'
+LEGACY_SOLD_CACHE_NAME = 'sold-cache.json'
+JOIN_CURSOR = 'join_all_holders'
+
+
+class SoldIndex:
+    def __init__(self, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, SOLD_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS sold (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    link TEXT NOT NULL UNIQUE,
+                    id TEXT NOT NULL,
+                    sold_date TEXT NOT NULL
+                )
+            ''')
+            # last sequence number applied by each consumer of the index
+            self.conn.execute('CREATE TABLE IF NOT EXISTS cursors (name TEXT PRIMARY KEY, seq INTEGER NOT NULL)')
+            self.conn.execute('CREATE TABLE IF NOT EXISTS imported (file TEXT PRIMARY KEY)')
+        self.links = set()
+        self.dates = {}
+        self.seq = 0
+        self.refresh()
+
+    def __contains__(self, link):
+        return link in self.links
+
+    def __len__(self):
+        return len(self.links)
+
+    def get(self, property_id):
+        """:return: sold date of the listing, None if it wasn't found sold"""
+        return self.dates.get(str(property_id))
+
+    def rows_since(self, seq):
+        return self.conn.execute('SELECT seq, link, id, sold_date FROM sold WHERE seq > ? ORDER BY seq', (seq,))
+
+    def refresh(self):
+        """load the sold listings added since the last refresh, by this or other processes"""
+        for seq, link, property_id, sold_date in self.rows_since(self.seq):
+            self.links.add(link)
+            self.dates[property_id] = sold_date
+            self.seq = seq
+
+    def add(self, link, property_id, sold_date):
+        self.add_many([(link, property_id, sold_date)])
+
+    def add_many(self, items):
+        """:param items: (link, property id, sold date) of sold listings. known links are skipped"""
+        new = [(link, str(property_id), sold_date) for link, property_id, sold_date in items
+               if link not in self.links]
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO sold (link, id, sold_date) VALUES (?, ?, ?)', new)
+        self.refresh()
+
+    def import_legacy(self, cache_file=None):
+        """add the sold listings of the old {link: {'id', 'date'}} json cache. done only once"""
+        cache_file = cache_file or os.path.join(config.CACHE_DIR, LEGACY_SOLD_CACHE_NAME)
+        if self.conn.execute('SELECT 1 FROM imported WHERE file = ?', (cache_file,)).fetchone():
+            return
+        try:
+            with open(cache_file) as f:
+                sold_property_cache = json.load(f)
+        except FileNotFoundError:
+            sold_property_cache = {}
+        self.add_many((link, sold['id'], sold['date']) for link, sold in sold_property_cache.items())
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO imported (file) VALUES (?)', (cache_file,))
+        logger.info(f'{len(sold_property_cache)} sold properties imported from: {cache_file}')
+
+    def cursor(self, name):
+        row = self.conn.execute('SELECT seq FROM cursors WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def set_cursor(self, name, seq):
+        with self.conn:
+            self.conn.execute('INSERT INTO cursors (name, seq) VALUES (?, ?) '
+                              'ON CONFLICT (name) DO UPDATE SET seq = excluded.seq', (name, seq))
+
+    def join(self, storage, seen, locations, exporter=None):
+        """
+        set the sold dates added since the last join on the listings of every location holding them
+
+        :param seen: the SeenIndex, it knows the locations holding every listing
+        :param exporter: the reports of the updated locations are marked dirty on it
+        :return: {location id: number of listings updated}
+        """
+        # the join used to reach only the first location of a listing. a new cursor name applies every
+        # date once more, only the entries that still miss their date are written
+        rows = self.rows_since(self.cursor(JOIN_CURSOR)).fetchall()
+        if not rows:
+            return {}
+        new_dates = {property_id: sold_date for _, _, property_id, sold_date in rows}
+
+        # a listing can be held by several locations, all of them get the date
+        property_ids_by_location = {}
+        for property_id, location_ids in seen.holders(new_dates).items():
+            for location_id in location_ids:
+                property_ids_by_location.setdefault(location_id, []).append(property_id)
+
+        locations_by_id = {str(location['id']): location for location in locations}
+        updated = {}
+        for location_id, property_ids in property_ids_by_location.items():
+            # only the sold date is written, under the storage lock, so a search saving its
+            # matches at the same time can't undo it
+            def set_sold_date(entry):
+                if entry.get('sold_date') == new_dates[str(entry['id'])]:
+                    return False
+                entry['sold_date'] = new_dates[str(entry['id'])]
+                return True
+
+            changed = storage.update(location_id, property_ids, set_sold_date)
+            if not changed:
+                continue
+            updated[location_id] = len(changed)
+            if exporter is not None and location_id in locations_by_id:
+                exporter.mark_dirty(locations_by_id[location_id])
+
+        self.set_cursor(JOIN_CURSOR, rows[-1][0])
+        logger.info(f'{len(new_dates)} new sold dates. {sum(updated.values())} listings updated '
+                    f'in {len(updated)} locations')
+        return updated
+
+
+_sold_index = None
+
+
+def get_sold_index():
+    """the index shared by everything in this process, with the old sold cache imported on first use"""
+    global _sold_index
+    if _sold_index is None:
+        _sold_index = SoldIndex()
+        _sold_index.import_legacy()
+    return _sold_index
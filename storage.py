@@ -0,0 +1,239 @@
+import os
+import sqlite3
+import config
+import metrics
+import profiling
+import records
+from atomic_io import file_lock, atomic_write
+
+logger = config.logger
+
+# which backend to use for the per location results. "json" keeps the old
+# <location_id>.json files, "sqlite" keeps every listing as a row in one database
+STORAGE_BACKEND = getattr(config, 'storage_backend', 'json')
+SQLITE_DB_NAME = getattr(config, 'storage_db_file', 'results.db')
+
+SAVE_SECONDS = metrics.histogram('scraper_save_seconds', 'time spent writing results', ['backend'])
+
+
+class JsonStorage:
+    """
+    one <location_id>.json file per location. writes merge the changed entries into the file
+    under a lock and replace it in one rename
+    """
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or config.CACHE_DIR
+
+    def path(self, location_id):
+        return os.path.join(self.cache_dir, f'{location_id}.json')
+
+    def load(self, location_id):
+        cache_file = self.path(location_id)
+        if not os.path.exists(cache_file):
+            return {}
+        with open(cache_file, 'rb') as f:
+            return records.load_listings(f.read())
+
+    def get(self, location_id, property_id):
+        return self.load(location_id).get(property_id)
+
+    def get_many(self, location_id, property_ids):
+        """:return: {property id: entry} of the listings that exist"""
+        results = self.load(location_id)
+        return {property_id: results[property_id] for property_id in property_ids if property_id in results}
+
+    def iter_listings(self, location_id):
+        """:return: iterator of (property id, entry). the json file can only be read as a whole"""
+        return iter(self.load(location_id).items())
+
+    @profiling.stage('save')
+    @SAVE_SECONDS.time(backend='json')
+    def save(self, location_id, results, changed_ids=None):
+        """
+        :param changed_ids: only these entries are written over the ones on disk, so changes made by
+            other scripts since `results` was loaded are kept. everything is written if None
+        """
+        cache_file = self.path(location_id)
+        with file_lock(cache_file):
+            if changed_ids is None:
+                merged = results
+            else:
+                merged = self.load(location_id)
+                for property_id in changed_ids:
+                    merged[property_id] = results[property_id]
+            # the files always started with a byte order mark, keep it for whatever else reads them
+            with atomic_write(cache_file, 'wb') as f:
+                f.write(records.UTF8_BOM + records.dumps(merged))
+        logger.info(f'cache saved as: {cache_file}')
+
+    def update(self, location_id, property_ids, mutate):
+        """
+        change stored entries in place. the file is read, changed and written under its lock,
+        so changes other scripts make to the same or other fields in the meantime are never lost
+
+        :param mutate: called with every entry of `property_ids` that exists. returns True if it changed it
+        :return: {property id: entry} of the changed entries
+        """
+        cache_file = self.path(location_id)
+        with file_lock(cache_file):
+            results = self.load(location_id)
+            changed = {property_id: results[property_id] for property_id in property_ids
+                       if property_id in results and mutate(results[property_id])}
+            if changed:
+                with profiling.stage('save'), SAVE_SECONDS.time(backend='json'):
+                    with atomic_write(cache_file, 'wb') as f:
+                        f.write(records.UTF8_BOM + records.dumps(results))
+                logger.info(f'{len(changed)} results updated in: {cache_file}')
+        return changed
+
+    def location_ids(self):
+        if not os.path.isdir(self.cache_dir):
+            return []
+        return [name[:-5] for name in os.listdir(self.cache_dir)
+                if name.endswith('.json') and name[:-5].isdigit()]
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """
+    every listing is one row, so a single listing can be written without touching the rest.
+    the full entry is kept as json in `data`, the columns next to it are only there to be indexed
+    """
+
+    def __init__(self, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, SQLITE_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.db_file = db_file
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.create_tables()
+
+    def create_tables(self):
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS listings (
+                    location_id TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    complete INTEGER NOT NULL DEFAULT 0,
+                    try_count INTEGER NOT NULL DEFAULT 0,
+                    sold_date TEXT NOT NULL DEFAULT '',
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (location_id, id)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_location ON listings (location_id)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_complete ON listings (complete)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_try_count ON listings (try_count)')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_listings_sold_date ON listings (sold_date)')
+
+    def load(self, location_id):
+        rows = self.conn.execute('SELECT id, data FROM listings WHERE location_id = ?', (str(location_id),))
+        return {property_id: records.Listing.from_dict(records.loads(data)) for property_id, data in rows}
+
+    def get_many(self, location_id, property_ids):
+        """:return: {property id: entry} of the listings that exist"""
+        results = {}
+        property_ids = [str(property_id) for property_id in property_ids]
+        # sqlite limits the number of parameters of a query
+        for start in range(0, len(property_ids), 500):
+            chunk = property_ids[start:start + 500]
+            rows = self.conn.execute(f'SELECT id, data FROM listings WHERE location_id = ? AND id IN '
+                                     f'({", ".join("?" * len(chunk))})', [str(location_id)] + chunk)
+            for property_id, data in rows:
+                results[property_id] = records.Listing.from_dict(records.loads(data))
+        return results
+
+    def iter_listings(self, location_id):
+        """:return: iterator of (property id, entry), read from the database one row at a time"""
+        rows = self.conn.execute('SELECT id, data FROM listings WHERE location_id = ?', (str(location_id),))
+        for property_id, data in rows:
+            yield property_id, records.Listing.from_dict(records.loads(data))
+
+    def get(self, location_id, property_id):
+        row = self.conn.execute('SELECT data FROM listings WHERE location_id = ? AND id = ?',
+                                (str(location_id), str(property_id))).fetchone()
+        return records.Listing.from_dict(records.loads(row[0])) if row else None
+
+    @staticmethod
+    def to_row(location_id, entry):
+        return (
+            str(location_id),
+            str(entry['id']),
+            1 if entry.get('complete') else 0,
+            entry.get('try_count') or 0,
+            entry.get('sold_date') or '',
+            records.dumps(entry).decode('utf-8')
+        )
+
+    @profiling.stage('save')
+    @SAVE_SECONDS.time(backend='sqlite')
+    def save(self, location_id, results, changed_ids=None):
+        entries = results.values() if changed_ids is None else [results[property_id] for property_id in changed_ids]
+        rows = [self.to_row(location_id, entry) for entry in entries]
+        with self.conn:
+            self.conn.executemany(self.UPSERT_SQL, rows)
+        logger.info(f'{len(rows)} results saved in: {self.db_file}')
+
+    def update(self, location_id, property_ids, mutate):
+        """
+        change stored entries in place. they are read, changed and written in one transaction,
+        so changes other scripts make to the same or other fields in the meantime are never lost
+
+        :param mutate: called with every entry of `property_ids` that exists. returns True if it changed it
+        :return: {property id: entry} of the changed entries
+        """
+        # the write lock is taken before reading, so nobody can write between the read and the write
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            changed = {property_id: entry for property_id, entry in self.get_many(location_id, property_ids).items()
+                       if mutate(entry)}
+            with profiling.stage('save'), SAVE_SECONDS.time(backend='sqlite'):
+                self.conn.executemany(self.UPSERT_SQL, [self.to_row(location_id, entry) for entry in changed.values()])
+            self.conn.commit()
+        except:
+            self.conn.rollback()
+            raise
+        if changed:
+            logger.info(f'{len(changed)} results updated in: {self.db_file}')
+        return changed
+
+    @profiling.stage('save')
+    @SAVE_SECONDS.time(backend='sqlite')
+    def location_ids(self):
+        return [row[0] for row in self.conn.execute('SELECT DISTINCT location_id FROM listings')]
+
+    def close(self):
+        self.conn.close()
+
+    UPSERT_SQL = '''
+        INSERT INTO listings (location_id, id, complete, try_count, sold_date, data)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (location_id, id) DO UPDATE SET
+            complete = excluded.complete,
+            try_count = excluded.try_count,
+            sold_date = excluded.sold_date,
+            data = excluded.data
+    '''
+
+
+BACKENDS = {
+    'json': JsonStorage,
+    'sqlite': SqliteStorage,
+}
+
+_storage = None
+
+
+def get_storage():
+    """the storage backend selected by `config.storage_backend`, created once per process"""
+    global _storage
+    if _storage is None:
+        try:
+            _storage = BACKENDS[STORAGE_BACKEND]()
+        except KeyError:
+            raise ValueError(f'unknown storage backend: {STORAGE_BACKEND}. use one of {list(BACKENDS)}')
+    return _storage
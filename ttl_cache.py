@@ -0,0 +1,90 @@
+import os
+import json
+import time
+import sqlite3
+import config
+from metrics import CACHE_REQUESTS
+
+logger = config.logger
+
+CACHE_DB_NAME = 'lookup-cache.db'
+
+
+class TTLCache:
+    """
+    json values on disk with an expiry time. when there are more than `max_entries` values
+    the least recently used ones are removed
+    """
+
+    def __init__(self, name, ttl, max_entries, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, CACHE_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.name = name
+        self.table = f'cache_{name}'
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    used_at REAL NOT NULL
+                )
+            ''')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_used_at ON {self.table} (used_at)')
+        self.size = self.conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+
+    def get(self, key, max_age=None):
+        """
+        :param max_age: seconds a value may be old, the ttl of the cache by default. values that
+            are not evicted yet can be read after they expired with a larger one
+        """
+        now = time.time()
+        max_age = self.ttl if max_age is None else max_age
+        row = self.conn.execute(f'SELECT value, stored_at FROM {self.table} WHERE key = ?', (key,)).fetchone()
+        if row is None or now - row[1] > max_age:
+            self.misses += 1
+            CACHE_REQUESTS.inc(cache=self.name, result='misses')
+            return None
+        with self.conn:
+            self.conn.execute(f'UPDATE {self.table} SET used_at = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        CACHE_REQUESTS.inc(cache=self.name, result='hits')
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        now = time.time()
+        with self.conn:
+            cursor = self.conn.execute(f'UPDATE {self.table} SET value = ?, stored_at = ?, used_at = ? WHERE key = ?',
+                                       (json.dumps(value), now, now, key))
+            if cursor.rowcount == 0:
+                self.conn.execute(f'INSERT INTO {self.table} (key, value, stored_at, used_at) VALUES (?, ?, ?, ?)',
+                                  (key, json.dumps(value), now, now))
+                self.size += 1
+            if self.size > self.max_entries:
+                self.evict(now)
+
+    def evict(self, now):
+        # expired values go first, then the least recently used ones
+        self.conn.execute(f'DELETE FROM {self.table} WHERE stored_at < ?', (now - self.ttl,))
+        self.size = self.conn.execute(f'SELECT COUNT(*) FROM {self.table}').fetchone()[0]
+        if self.size > self.max_entries:
+            self.conn.execute(f'''
+                DELETE FROM {self.table} WHERE key IN (
+                    SELECT key FROM {self.table} ORDER BY used_at LIMIT ?
+                )
+            ''', (self.size - self.max_entries,))
+            self.size = self.max_entries
+
+    def stats(self):
+        total = self.hits + self.misses
+        ratio = self.hits / total * 100 if total else 0
+        return f'{self.name} cache: {self.hits} hits, {self.misses} misses ({ratio:.0f}% hit ratio)'
+
+    def close(self):
+        self.conn.close()
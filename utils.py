@@ -1,45 +1,116 @@
 import os
-import re
 import time
 import json
 import config
-import random
-import openpyxl
-import requests
-from bs4 import BeautifulSoup
+import threading
+import cassette
+import metrics
+import profiling
+import http_client
+from storage import get_storage
+from seen_index import get_seen_index
+from sold_index import get_sold_index
+from fetcher import ConcurrentFetcher
+from extractors import get_extractor
+from datalayer import parse_property, parse_sold_property
+from export import Exporter, get_phone_columns
+from ttl_cache import TTLCache
+from records import Listing
+from address import split_floor, normalize
+from matching import get_index
+from http_client import create_session, HTTP_POOL_SIZE
+from http_cache import CachingAdapter, get_http_cache
+from crawl_state import EarlyStop, get_newest, set_newest
 
 USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 ' \
              '(KHTML, like Gecko) Chrome/86.0.4240.75 Safari/537.36'
 
 logger = config.logger
 
+# base urls of the sites. only changed to run against a local server, see benchmarks/
+HEMNET_URL = getattr(config, 'hemnet_url', 'https://www.hemnet.se')
+FAKTAKONTROLL_URL = getattr(config, 'faktakontroll_url', 'https://www.faktakontroll.se')
+
+# faktakontroll person details are kept for this many seconds
+ENTITY_CACHE_TTL = getattr(config, 'entity_cache_ttl', 30 * 24 * 60 * 60)
+ENTITY_CACHE_MAX_ENTRIES = getattr(config, 'entity_cache_max_entries', 100000)
+# faktakontroll search results of an address are kept for this many seconds
+ADDRESS_CACHE_TTL = getattr(config, 'address_cache_ttl', 7 * 24 * 60 * 60)
+ADDRESS_CACHE_MAX_ENTRIES = getattr(config, 'address_cache_max_entries', 50000)
+# the faktakontroll token is renewed this many seconds before it expires
+TOKEN_REFRESH_MARGIN = getattr(config, 'token_refresh_margin', 60)
+
+PARSE_SECONDS = metrics.histogram('scraper_parse_seconds', 'time spent parsing a hemnet page', ['page'])
+
+
+def make_adapter(use_http_cache=False):
+    """
+    :return: adapter for a new session if the traffic is recorded, replayed or cached. None for the default one
+    """
+    recording = cassette.get_cassette()
+    if recording:
+        return cassette.CassetteAdapter(recording, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    http_cache = get_http_cache() if use_http_cache else None
+    if http_cache:
+        return CachingAdapter(http_cache, pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+    return None
+
 
 class Hemnet:
-    def __init__(self, location):
+    def __init__(self, location, rate_limiter=None, session=None, fetcher=None, load_results=True):
+        """
+        :param session: with `fetcher`, the connections to use. they belong to the caller, who closes them
+        :param load_results: False if the stored results of the location are not needed, e.g. for sold listings
+        """
         self.location_id = location['id']
         self.location_name = location['location']
         self.results = None
+        self.changed_ids = set()
+        self.storage = get_storage()
+        self.seen = get_seen_index()
+        self.sold = get_sold_index()
         self.session = None
+        self.fetcher = None
+        self.rate_limiter = rate_limiter
         self.ignored_location_ids = None
         self.load_ignored_locations()
-        self.load_results()
-        self.init_session()
+        if load_results:
+            self.load_results()
+        else:
+            self.results = {}
+        self.owns_session = session is None
+        self.init_session(session, fetcher)
+
+    def init_session(self, session=None, fetcher=None):
+        self.session = session or self.new_session()
+        self.fetcher = fetcher or ConcurrentFetcher(self.new_session, rate_limiter=self.rate_limiter)
+
+    def close(self):
+        if self.owns_session:
+            self.fetcher.close()
+            self.session.close()
 
-    def init_session(self):
-        self.session = requests.session()
-        self.session.headers = {
+    @staticmethod
+    def new_session():
+        return create_session(adapter=make_adapter(use_http_cache=True), headers={
             'Accept': 'application/json, text/javascript, */*; q=0.01',
             'Referer': '',
             'DNT': '1',
             'User-Agent': USER_AGENT,
             'X-Requested-With': 'XMLHttpRequest',
-        }
+        })
 
     def search(self):
         results = []
-        for page_num in range(1, 51):
-            logger.info(f'{self.location_name}: page {page_num}')
-            params = {
+        newest_id = None
+        early_stop = EarlyStop(get_newest(self.location_id, 'listing'))
+        # pages are requested in batches of the fetch concurrency. the batch containing
+        # the first empty page is the last one
+        batch_size = self.fetcher.concurrency
+        for first_page in range(1, 51, batch_size):
+            page_nums = list(range(first_page, min(first_page + batch_size, 51)))
+            logger.info(f'{self.location_name}: page {", ".join(map(str, page_nums))}')
+            params_list = [{
                 'by': 'creation',
                 'housing_form_groups[]': ['houses', 'row_houses', 'apartments'],
                 'location_ids[]': self.location_id,
@@ -47,137 +118,131 @@ class Hemnet:
                 'page': str(page_num),
                 'preferred_sorting': 'true',
                 'new_construction': 'exclude'
-            }
-            try:
-                res = self.session.get('https://www.hemnet.se/bostader', params=params)
-                soup = BeautifulSoup(res.content, 'html.parser')
-                # list all the search results in current page
-                lis = soup.find_all('li', {'class': 'normal-results__hit js-normal-list-item'})
-
-                for li in lis:
-                    try:
-                        result_id = json.loads(li['data-gtm-item-info'])['id']
-                        if result_id not in self.ignored_location_ids and result_id not in self.results:
-                            results.append({
-                                'url': li.find('a')['href'],
-                                'id': result_id
-                            })
-                    except Exception as e:
-                        logger.error(f'could not get link. error: {e}')
-                if len(lis) == 0:
-                    break
-            except Exception as e:
-                logger.error(e)
+            } for page_num in page_nums]
+            with profiling.stage('search'):
+                responses = self.fetcher.get_all([f'{HEMNET_URL}/bostader'] * len(page_nums), params_list)
+
+            last_page = False
+            for res in responses:
+                try:
+                    if isinstance(res, Exception):
+                        raise res
+                    with profiling.stage('parse'), PARSE_SECONDS.time(page='search'):
+                        page_results = self.parse_search_page(res.content)
+                    for result in page_results:
+                        if not self.is_known(result['id']):
+                            results.append(result)
+                    if len(page_results) == 0:
+                        last_page = True
+                        break
+                    if newest_id is None:
+                        newest_id = page_results[0]['id']
+                    if early_stop.page_done([result['id'] for result in page_results], self.is_known):
+                        logger.info(f'{self.location_name}: no new results on the last pages. stopping')
+                        last_page = True
+                        break
+                except Exception as e:
+                    logger.error(e)
+            if last_page:
+                break
+        set_newest(self.location_id, 'listing', newest_id)
+        logger.info(f'{self.location_name}: {self.fetcher.summary()}')
         return results
 
+    def is_known(self, result_id):
+        result_id = str(result_id)
+        if result_id in self.ignored_location_ids or result_id in self.results:
+            return True
+        # listings of overlapping locations are only kept for the location they were found in first
+        owner = self.seen.owner(result_id)
+        return owner is not None and owner != str(self.location_id)
+
+    @staticmethod
+    def parse_search_page(content):
+        return get_extractor().listing_hits(content)
+
+    def get_details_many(self, results):
+        """fetch the details of all the results concurrently and add them in the same order as `results`"""
+        with profiling.stage('detail_fetch'):
+            responses = self.fetcher.get_all([result['url'] for result in results])
+        results_count = len(results)
+        for i, (result, response) in enumerate(zip(results, responses)):
+            if i == (results_count - 1) or (i + 1) % 10 == 0 and i != 1:
+                logger.info(f'{i + 1} of {results_count} properties searched on hemnet')
+            if isinstance(response, Exception):
+                logger.error(f'could not get data for [{result["url"]}]. errorL: {response}')
+                continue
+            self.parse_details(result, response)
+        logger.info(f'{self.location_name}: {self.fetcher.summary()}')
+
     def get_details(self, result):
         try:
             # get the response
             response = self.session.get(result['url'])
+        except Exception as e:
+            logger.error(f'could not get data for [{result["url"]}]. errorL: {e}')
+            return False
+        return self.parse_details(result, response)
 
-            # get datalayer text
-            datalayer_text = re.findall(r'dataLayer *?= *?.*?;', response.text)[0]
-            datalayer_text = datalayer_text[datalayer_text.index('['):-1]
-            datalayer = json.loads(datalayer_text)
-
+    def parse_details(self, result, response):
+        try:
             # get property details from datalayer
-            _property = None
-            for dl in datalayer:
-                _property = dl.get('property')
-                if _property:
-                    break
+            with profiling.stage('parse'), PARSE_SECONDS.time(page='listing'):
+                _property = parse_property(response.content)
             if not _property:
                 logger.error('property not found')
                 return False
 
-            floor = None
-            floor_patterns = [r'\d{1,2} ?tr', r'vån ?\d{1,2}']
-            # get full address address
-            full_address = _property.get('street_address')
-            # remove everything after comma
-            address_wo_floor = full_address.split(',')[0]
-
-            try:
-                # check for floor in this stripped address
-                # remove from address: <number> tr, vån <number>
-                floor_patterns = [r'\d{1,2} ?tr', r'vån ?\d{1,2}']
-                for re_pattern in floor_patterns:
-                    matches = re.findall(re_pattern, address_wo_floor)
-                    if len(matches) > 0:
-                        try:
-                            floor = int(re.findall(r'\d{1,2}', matches[0])[0])
-                            address_wo_floor = re.sub(re_pattern, '', address_wo_floor).strip()
-                            break
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-
-            # if floor already not found get it from the entire address
-            if not floor:
-                for re_pattern in floor_patterns:
-                    matches = re.findall(re_pattern, full_address)
-                    if len(matches) > 0:
-                        try:
-                            floor = int(re.findall(r'\d{1,2}', matches[0])[0])
-                            break
-                        except Exception:
-                            pass
-
-            property_id = str(_property.get('id'))
-
-            self.results[property_id] = {
-                'id': property_id,
-                'url': result['url'],
-                'city': _property.get('location'),
-                'street_address': address_wo_floor,
-                'floor': floor,
-                'area': _property.get('living_area'),
-                'house_type': _property.get('housing_form') or '',
-                'extra_area': _property.get('supplemental_area'),
-                'publication_date': _property.get('publication_date'),
-                'complete': False,
-                'sold_date': '',
-                'matches': None,
-                'try_count': 0
-            }
+            address_wo_floor, floor = split_floor(_property.street_address)
+
+            property_id = _property.id
+
+            self.changed_ids.add(property_id)
+            self.results[property_id] = Listing(
+                id=property_id,
+                url=result['url'],
+                city=_property.location,
+                street_address=address_wo_floor,
+                floor=floor,
+                area=_property.living_area,
+                house_type=_property.housing_form or '',
+                extra_area=_property.supplemental_area,
+                publication_date=_property.publication_date,
+                complete=False,
+                # listings found after they were sold get their date here, the join only sees new sold dates
+                sold_date=self.sold.get(property_id) or '',
+                matches=None,
+                try_count=0
+            )
             return True
         except Exception as e:
             logger.error(f'could not get data for [{result["url"]}]. errorL: {e}')
             return False
 
     def save_results(self):
-        os.makedirs(config.CACHE_DIR, exist_ok=True)
-        cache_file = os.path.join(config.CACHE_DIR, f'{self.location_id}.json')
-
-        # other scripts might try to access this file at the same time.
-        # so try to save it 3 times if failed to save
-        for _ in range(3):
-            try:
-                with open(cache_file, 'w', encoding='utf-8-sig') as f:
-                    json.dump(self.results, f)
-                logger.info(f'cache saved as: {cache_file}')
-                break
-            except:
-                time.sleep(random.randint(3, 10))
+        """write the results changed since they were loaded, keeping changes other scripts made to the rest"""
+        self.storage.save(self.location_id, self.results, self.changed_ids)
+        self.seen.add(self.location_id, self.changed_ids)
+        self.changed_ids = set()
 
     def load_results(self):
-        old_result_path = os.path.join(config.CACHE_DIR, f'{self.location_id}.json')
-        if os.path.exists(old_result_path):
-            with open(old_result_path, encoding='utf-8-sig') as f:
-                self.results = json.load(f)
-        else:
-            self.results = {}
+        self.results = self.storage.load(self.location_id)
+        self.changed_ids = set()
 
     def load_ignored_locations(self):
         try:
             with open(os.path.join(config.CACHE_DIR, 'ignored.json')) as f:
-                self.ignored_location_ids = json.load(f)
+                self.ignored_location_ids = set(map(str, json.load(f)))
         except:
-            self.ignored_location_ids = []
+            self.ignored_location_ids = set()
 
-    def search_sold_properties(self):
+    def search_sold_properties(self, known_links=()):
+        """
+        :param known_links: links already fetched before. used to stop paginating once only known
+            sold properties are listed
+        """
         sold_property_links = []
+        early_stop = EarlyStop(get_newest(self.location_id, 'sold'))
         logger.info('getting sold properties on hemnet')
         for page_num in range(1, 51):
             if page_num % 10 == 0:
@@ -188,148 +253,52 @@ class Hemnet:
                 'page': page_num
             }
             try:
-                response = self.session.get('https://www.hemnet.se/salda/bostader', params=params)
-                soup = BeautifulSoup(response.content, 'html.parser')
-                links = soup.find_all('a', {'class': 'sold-property-listing'})
+                with profiling.stage('search'):
+                    response = self.fetcher.get(f'{HEMNET_URL}/salda/bostader', params=params)
+                if isinstance(response, Exception):
+                    raise response
+                with profiling.stage('parse'), PARSE_SECONDS.time(page='sold_search'):
+                    page_links = get_extractor().sold_links(response.content)
             except:
-                links = []
-            for link in links:
-                try:
-                    href = link['href']
-                    sold_property_links.append(href)
-                except:
-                    pass
+                page_links = []
+            sold_property_links.extend(page_links)
+            if early_stop.page_done(page_links, lambda href: href in known_links):
+                logger.info(f'{self.location_name}: no new sold properties on the last pages. stopping')
+                break
+        if sold_property_links:
+            set_newest(self.location_id, 'sold', sold_property_links[0])
         return sold_property_links
 
     def get_sold_property_date(self, property_link):
-        sold_date = 'date not found'
-        prop_id = None
         try:
-            resp = self.session.get(property_link)
-            datalayer_text = re.findall(r'(?<=dataLayer = )(.*)(?=;)', resp.text)[0]
-            datalayer = json.loads(datalayer_text)
-            for dl in datalayer:
-                try:
-                    if 'property' in dl.keys():
-                        prop_id = str(dl['property']['id'])
-                    if 'sold_property' in dl.keys():
-                        sold_date = dl['sold_property']['sold_at_date']
-                except:
-                    pass
-            if prop_id:
-                return {'date': sold_date, 'id': prop_id}
+            with profiling.stage('detail_fetch'):
+                resp = self.fetcher.get(property_link)
+            if isinstance(resp, Exception):
+                raise resp
+            with profiling.stage('parse'), PARSE_SECONDS.time(page='sold_listing'):
+                sold = parse_sold_property(resp.content)
+            if sold:
+                return {'date': sold.sold_at_date, 'id': sold.property_id}
         except Exception as e:
             return None
 
-    def save_xlsx(self):
-        logger.info('saving data in excel file...')
-        headers = ['Id', 'Tot Hits', 'Tot Apartments', 'Address', 'City', 'Bostadstyp', 'Area', 'Extra Area',
-                   'Floor', 'Name', 'Kön', 'Personnr', 'Ålder'] + [
-                      'Phone 1', 'Phone 2', 'Phone 3', 'Phone 4', 'Phone 5', 'Phone 6',
-                  ] + ['Apartment', 'Area Match Type', 'Publish Date', 'Sold']
+    def save_xlsx(self, force=False):
+        location = {'id': self.location_id, 'location': self.location_name}
+        return Exporter().export(location, self.results, force=force)
 
-        data = []
-        for match_id, entry in self.results.items():
-            if not entry['complete'] or not entry['matches']:
-                continue
-
-            try:
-                address = entry.get('street_address') or ''
-                city = entry.get('city') or ''
-                house_type = entry.get('house_type') or ''
-                area = entry.get('area') or ''
-                extra_area = entry.get('extra_area') or ''
-                floor = entry.get('floor') or ''
-                total_matches = len(entry['matches'])
-                apartments = []
-                sold = entry.get('sold')
-                row_template = [match_id, total_matches, 1, address, city, house_type, area, extra_area, floor]
-
-                new_rows = []
-                for match in entry['matches']:
-                    new_row = row_template.copy()
-                    apartment = match.get('apartment') or ''
-                    if apartment and apartment in apartments:
-                        pass
-                    else:
-                        apartments.append(apartment)
-                    # print('pn:', match.get('person_number') or '')
-                    new_row += [match['name'], match.get('gender') or '', match['person_number'],
-                                match.get('age') or '',
-                                ] + self.get_phone_columns(match['numbers']) + [
-                                   f'lgh {apartment}' if apartment else '',
-                                   'Full' if match[
-                                       'full_match'] else 'Partial',
-                                   entry.get('publication_date'),
-                                   sold
-                               ]
-                    new_rows.append(new_row)
-
-                    # check if apartment is empty then number of apartments would be 1
-                    for row in new_rows:
-                        if row[len(row_template) + 10].strip() == '':
-                            row[2] = 1
-                        else:
-                            row[2] = len(apartments)
-
-                if len(new_rows) <= config.max_results:
-                    data.extend(new_rows)
-            except Exception as e:
-                # logger.error(e)
-                pass
-
-        # create the excel workbook
-        wb = openpyxl.Workbook()
-        sheet = wb.active
-        sheet.append(headers)
-        for row in data:
-            sheet.append(row)
-
-        # freeze the header
-        sheet.freeze_panes = 'A2'
-
-        # add filters to all columns
-        sheet.auto_filter.ref = sheet.dimensions
-
-        # save the workbook in this location
-        filename = os.path.join(config.DOC_DIR, f'{self.location_name}.xlsx')
-
-        # create the doc dir if not present
-        os.makedirs(config.DOC_DIR, exist_ok=True)
-
-        # try to save the file at most 3 times in case some error occurs
-        for _ in range(3):
-            try:
-                wb.save(filename)
-                logger.info(f'data saved as "{filename}"')
-                break
-            except Exception as e:
-                time.sleep(random.randint(2, 5))
-                logger.error(f'could not save "{filename}". retrying...')
-
-    @staticmethod
-    def get_phone_columns(phone_numbers):
-        if len(phone_numbers) > 6:
-            phone_numbers = phone_numbers[:6]
-        elif len(phone_numbers) < 6:
-            phone_numbers += [''] * (6 - len(phone_numbers))
-        return phone_numbers
+    get_phone_columns = staticmethod(get_phone_columns)
 
 
 class Faktakontroll:
     def __init__(self):
         self.access_token = None
         self.access_token_valid_till = 0
-        self.token_server_session = requests.session()
-        self.token_server_session.headers = {'api-key': config.fk_api_key}
-
-    @property
-    def faktakontroll_headers(self):
-        return {
+        self.token_lock = threading.Lock()
+        self.token_refresh_timer = None
+        self.token_server_session = create_session({'api-key': config.fk_api_key}, adapter=make_adapter())
+        self.session = create_session(adapter=make_adapter(), headers={
             'Connection': 'keep-alive',
             'Accept': 'application/json, text/plain, */*',
-            'X-Initialized-At': str(int(time.time() * 1000)),
-            'X-Auth-Token': self.get_token(),
             'User-Agent': USER_AGENT,
             'DNT': '1',
             'Content-Type': 'application/json;charset=UTF-8',
@@ -339,31 +308,65 @@ class Faktakontroll:
             'Sec-Fetch-Dest': 'empty',
             'Referer': 'https://www.faktakontroll.se/app/sok',
             'Accept-Language': 'en-IN,en-GB;q=0.9,en-US;q=0.8,en;q=0.7',
+        })
+        self.entity_cache = TTLCache('entity', ENTITY_CACHE_TTL, ENTITY_CACHE_MAX_ENTRIES)
+        self.address_cache = TTLCache('address', ADDRESS_CACHE_TTL, ADDRESS_CACHE_MAX_ENTRIES)
+
+    @property
+    def faktakontroll_headers(self):
+        """headers that change with every request. the rest are set on the session"""
+        return {
+            'X-Initialized-At': str(int(time.time() * 1000)),
+            'X-Auth-Token': self.get_token(),
         }
 
     def get_token(self):
-        if self.access_token and self.access_token_valid_till > time.time():
+        # the token is normally renewed in the background before it expires
+        if self.access_token and self.access_token_valid_till - TOKEN_REFRESH_MARGIN > time.time():
             return self.access_token
+        return self.refresh_token()
 
-        try:
-            response = requests.post(f'{config.host}/getToken', headers={
-                'api-key': config.fk_api_key
-            })
-            if response.status_code == 200:
-                data = response.json()
-                self.access_token = data['accessToken']
-                self.access_token_valid_till = time.time() + data['validFor']
-                logger.info(f'faktakontroll access token updated. valid for: {data["validFor"]}s')
+    def refresh_token(self):
+        with self.token_lock:
+            if self.access_token and self.access_token_valid_till - TOKEN_REFRESH_MARGIN > time.time():
+                return self.access_token
+            try:
+                response = self.token_server_session.post(f'{config.host}/getToken')
+                if response.status_code == 200:
+                    data = response.json()
+                    self.access_token = data['accessToken']
+                    self.access_token_valid_till = time.time() + data['validFor']
+                    logger.info(f'faktakontroll access token updated. valid for: {data["validFor"]}s')
+                    self.schedule_token_refresh(data['validFor'])
+                    return self.access_token
+                else:
+                    logger.error('could not get access token for faktakontroll')
+            except Exception as e:
+                logger.error(f'could not get access token for faktakontroll. error: {e}')
+
+            # keep using the old token while it is still valid
+            if self.access_token and self.access_token_valid_till > time.time():
                 return self.access_token
-            else:
-                logger.error('could not get access token for faktakontroll')
-                return None
-        except Exception as e:
-            logger.error(f'could not get access token for faktakontroll. error: {e}')
             return None
 
+    def schedule_token_refresh(self, valid_for):
+        if self.token_refresh_timer:
+            self.token_refresh_timer.cancel()
+        self.token_refresh_timer = threading.Timer(max(valid_for - TOKEN_REFRESH_MARGIN, 1), self.refresh_token)
+        self.token_refresh_timer.daemon = True
+        self.token_refresh_timer.start()
+
     def search(self, search_string, try_count=0):
-        config.sleep_between_searches()
+        address_key = normalize(search_string)
+        hits = self.address_cache.get(address_key)
+        if hits is not None:
+            logger.info(f'faktakontroll results of "{address_key}" taken from cache. {self.address_cache.stats()}')
+            return self.get_individuals(hits)
+
+        # recorded responses are not rate limited
+        if not cassette.replaying():
+            with metrics.sleeping('between_searches'):
+                config.sleep_between_searches()
 
         data = {
             "searchString": search_string,
@@ -371,8 +374,9 @@ class Faktakontroll:
             "subscriptionRefNo": "20.750.025.01"
         }
         try:
-            response = requests.post('https://www.faktakontroll.se/app/api/search',
-                                     headers=self.faktakontroll_headers, json=data)
+            with profiling.stage('search'):
+                response = self.session.post(f'{FAKTAKONTROLL_URL}/app/api/search',
+                                             headers=self.faktakontroll_headers, json=data)
 
             # if failed to get 200 response then try once more
             if response.status_code != 200:
@@ -384,8 +388,9 @@ class Faktakontroll:
                     return None
 
             data = response.json()
-            results = data['hits']
-            return [result['individual'] for result in results if result.get('individual')]
+            hits = data['hits']
+            self.address_cache.set(address_key, hits)
+            return self.get_individuals(hits)
 
         except Exception as e:
             if try_count == 0:
@@ -395,14 +400,25 @@ class Faktakontroll:
                 logger.error(f'error while searching address on faktakontroll. error: {e}')
                 return None
 
+    @staticmethod
+    def get_individuals(hits):
+        return [hit['individual'] for hit in hits if hit.get('individual')]
+
     def get_more_details(self, result_id):
-        config.sleep_between_each_person()
+        cached = self.entity_cache.get(str(result_id))
+        if cached is not None:
+            return cached
+
+        if not cassette.replaying():
+            with metrics.sleeping('between_persons'):
+                config.sleep_between_each_person()
 
         params = {'subscriptionRefNo': '20.750.025.01'}
 
         try:
-            response = requests.get(f'https://www.faktakontroll.se/app/api/search/entity/{result_id}',
-                                    headers=self.faktakontroll_headers, params=params)
+            with profiling.stage('detail_fetch'):
+                response = self.session.get(f'{FAKTAKONTROLL_URL}/app/api/search/entity/{result_id}',
+                                            headers=self.faktakontroll_headers, params=params)
 
             data = response.json()['individual']
 
@@ -411,12 +427,14 @@ class Faktakontroll:
             except:
                 phone_numbers = []
 
-            return {
+            details = {
                 'numbers': phone_numbers,
                 'age': data.get('age'),
                 'gender': data.get('gender'),
                 'person_number': data.get('personalNumber')
             }
+            self.entity_cache.set(str(result_id), details)
+            return details
         except:
             return {
                 'numbers': [],
@@ -425,112 +443,19 @@ class Faktakontroll:
                 'person_number': None
             }
 
+    @profiling.stage('match')
     def find_matches(self, hemnet_result, faktakontroll_results):
+        index = get_index(faktakontroll_results)
         matched_results = []
-        for result in faktakontroll_results:
+        for position, full_match in index.match(hemnet_result):
             try:
-                is_match = True
-
-                # get apartment and floor number
-                street_address = result['fbfStreetAddress']
-
-                if 'lgh' in street_address:
-                    staddr = street_address[street_address.index('lgh'):]
-                    try:
-                        apartment = re.findall(r'\d{4}', staddr)[0]
-                        floor = (int(apartment[0]) - 1) * 10 + int(apartment[1])
-                    except:
-                        apartment = None
-                        floor = None
-                else:
-                    floor = None
-                    apartment = None
-
-                # if floor not found then use alternate method
-                # find floor on faktakontroll "\d{1,2} ?tr" or "vån ?\d{1,2}"
-                floor_patterns = [r'\d{1,2} ?tr', r'vån ?\d{1,2}']
-                for re_pattern in floor_patterns:
-                    matches = re.findall(re_pattern, street_address)
-                    if len(matches) > 0:
-                        try:
-                            floor = int(re.findall(re_pattern, matches[0])[0])
-                            break
-                        except Exception:
-                            pass
-
-                # get name
-                try:
-                    first_name = result.get('firstNames')
-                    middle_name = result.get('middleNames')
-                    last_name = result.get('lastNames')
-
-                    name = first_name or ''
-                    if middle_name:
-                        name += f' {middle_name}'
-                    if last_name:
-                        name += f' {last_name}'
-                except:
-                    name = ''
-
-                # get area
-                try:
-                    area = result['housingInfo']['area']
-                except:
-                    area = None
-
-                # check if the data matches with hemnet data
-                potential_match = {'full_match': True}
-
-                # if house type is villa or radhus then don't match anything. just add the results
-                if hemnet_result.get('house_type') not in ['Radhus', 'Villa']:
-                    ########### compare the areas ###############
-                    # convert the areas to float
-                    try:
-                        hemnet_area = float(hemnet_result.get('area'))
-                    except:
-                        hemnet_area = None
-                    try:
-                        faktakontroll_area = float(area)
-                    except:
-                        faktakontroll_area = None
-
-                    if hemnet_area:
-                        if not faktakontroll_area:
-                            is_match = False
-                        else:
-                            if hemnet_area == faktakontroll_area:
-                                pass
-                            elif faktakontroll_area - 1 < hemnet_area < faktakontroll_area + 1:
-                                potential_match['full_match'] = False
-                            else:
-                                is_match = False
-
-                    # check floor if floor found on hemnet
-                    try:
-                        hemnet_floor = int(hemnet_result['floor'])
-                    except:
-                        hemnet_floor = None
-
-                    if hemnet_floor is not None:
-                        # if no floor found in faktakontroll then its not a match
-                        if floor is None:
-                            is_match = False
-                        elif floor < hemnet_floor - 1:
-                            is_match = False
-                        elif floor > hemnet_floor + 1:
-                            is_match = False
-
-                if is_match:
-                    extra_info = self.get_more_details(result['id'])
-                    potential_match.update(extra_info)
-                    potential_match.update({
-                        'area': area,
-                        'name': name,
-                        'floor': floor,
-                        'apartment': apartment,
-                        'street_address': street_address
-                    })
-                    matched_results.append(potential_match)
+                extra_info = self.get_more_details(index.hits[position]['id'])
+                matched_results.append(index.to_match(position, full_match, extra_info))
             except Exception as e:
                 logger.error(f'error while trying to find a match. error: {e}')
         return matched_results
+
+    def log_stats(self):
+        """the lookup cache counters and http timings since the start of the process"""
+        logger.info(f'{self.entity_cache.stats()}. {self.address_cache.stats()}')
+        logger.info(f'faktakontroll http timings: {http_client.timings.summary()}')
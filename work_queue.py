@@ -0,0 +1,126 @@
+import os
+import sqlite3
+import config
+import records
+
+logger = config.logger
+
+QUEUE_DB_NAME = 'queue.db'
+
+
+class PendingQueue:
+    """
+    listings that still have to be searched on faktakontroll, one fifo per location.
+    search_hemnet.py pushes new listings and the faktakontroll loop takes them from the head,
+    so finding the next piece of work never needs the location caches to be scanned.
+    a copy of every entry is kept with it, so it is not read from the location cache either
+    """
+
+    def __init__(self, db_file=None):
+        db_file = db_file or os.path.join(config.CACHE_DIR, QUEUE_DB_NAME)
+        os.makedirs(os.path.dirname(db_file) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(db_file, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS pending (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    location_id TEXT NOT NULL,
+                    property_id TEXT NOT NULL,
+                    data TEXT,
+                    UNIQUE (location_id, property_id)
+                )
+            ''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_pending_location ON pending (location_id, seq)')
+            # queues of older versions only had the ids. their entries are read from the location cache
+            columns = [row[1] for row in self.conn.execute('PRAGMA table_info(pending)')]
+            if 'data' not in columns:
+                self.conn.execute('ALTER TABLE pending ADD COLUMN data TEXT')
+            # searched entries until they are written to the location cache
+            self.conn.execute('''
+                CREATE TABLE IF NOT EXISTS unsaved (
+                    location_id TEXT NOT NULL,
+                    property_id TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (location_id, property_id)
+                )
+            ''')
+            # locations whose existing cache was already put in the queue
+            self.conn.execute('CREATE TABLE IF NOT EXISTS seeded (location_id TEXT PRIMARY KEY)')
+
+    def push(self, location_id, property_ids, results=None):
+        """:param results: {property id: entry}, the entries are stored with their ids"""
+        rows = [(str(location_id), str(property_id), self.dump(results, property_id)) for property_id in property_ids]
+        with self.conn:
+            self.conn.executemany('INSERT OR IGNORE INTO pending (location_id, property_id, data) VALUES (?, ?, ?)',
+                                  rows)
+
+    @staticmethod
+    def dump(results, property_id):
+        if results is None or property_id not in results:
+            return None
+        return records.dumps(results[property_id]).decode('utf-8')
+
+    def peek(self, location_id):
+        """:return: (property id, entry) at the head of the queue, (None, None) if it's empty.
+            the entry is None if it was queued without one"""
+        row = self.conn.execute('SELECT property_id, data FROM pending WHERE location_id = ? ORDER BY seq LIMIT 1',
+                                (str(location_id),)).fetchone()
+        if row is None:
+            return None, None
+        property_id, data = row
+        return property_id, records.Listing.from_dict(records.loads(data)) if data else None
+
+    def remove(self, location_id, property_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM pending WHERE location_id = ? AND property_id = ?',
+                              (str(location_id), str(property_id)))
+
+    def finish(self, location_id, entry, pending):
+        """
+        keep a searched entry until it is saved with `saved`. if it's still pending it goes to the end
+        of its location's queue so the others get their turn first, otherwise it leaves the queue
+        """
+        row = (str(location_id), str(entry['id']), records.dumps(entry).decode('utf-8'))
+        with self.conn:
+            self.conn.execute('INSERT OR REPLACE INTO unsaved (location_id, property_id, data) VALUES (?, ?, ?)', row)
+            self.conn.execute('DELETE FROM pending WHERE location_id = ? AND property_id = ?', row[:2])
+            if pending:
+                self.conn.execute('INSERT INTO pending (location_id, property_id, data) VALUES (?, ?, ?)', row)
+
+    def unsaved(self):
+        """:return: {location id: {property id: entry}} of the searched entries not saved yet"""
+        unsaved = {}
+        for location_id, property_id, data in self.conn.execute('SELECT location_id, property_id, data FROM unsaved'):
+            unsaved.setdefault(location_id, {})[property_id] = records.Listing.from_dict(records.loads(data))
+        return unsaved
+
+    def unsaved_count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM unsaved').fetchone()[0]
+
+    def saved(self, location_id, property_ids):
+        with self.conn:
+            self.conn.executemany('DELETE FROM unsaved WHERE location_id = ? AND property_id = ?',
+                                  [(str(location_id), str(property_id)) for property_id in property_ids])
+
+    def is_seeded(self, location_id):
+        return self.conn.execute('SELECT 1 FROM seeded WHERE location_id = ?', (str(location_id),)).fetchone() is not None
+
+    def seed(self, location_id, results):
+        """put the pending listings of an existing cache in the queue. done only once per location"""
+        if self.is_seeded(location_id):
+            return
+        pending = [property_id for property_id, info in results.items() if is_pending(info)]
+        self.push(location_id, pending, results)
+        with self.conn:
+            self.conn.execute('INSERT OR IGNORE INTO seeded (location_id) VALUES (?)', (str(location_id),))
+        logger.info(f'{len(pending)} pending results of location {location_id} added to the queue')
+
+    def close(self):
+        self.conn.close()
+
+
+def is_pending(info):
+    # check on faktakontroll if there is no match found previously and the script
+    # tried to find it less than a certain times
+    return info.get('matches') is None and info.get('try_count', 0) < config.fk_max_retry